@@ -0,0 +1,127 @@
+import math
+import time
+from typing import Dict, Optional, Tuple
+
+from core.config import settings
+from core.events import event_bus
+from core.logger import logger
+from core.redis import redis_client
+
+GLOBAL_SCOPE = "global"
+
+# Атомарный token bucket: возвращает время ожидания в секундах (0 - запрос пропущен)
+TOKEN_BUCKET_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class MemoryRateLimiter:
+    """Token buckets kept in the API process"""
+
+    max_buckets = 10000
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # scope -> (tokens, updated_at)
+
+    async def hit(self, scope: str, rate: float, burst: int) -> float:
+        """Take a token, return seconds to wait if the bucket is empty"""
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(scope, (float(burst), now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[scope] = (tokens, now)
+        if len(self._buckets) > self.max_buckets:
+            self._prune(now, rate, burst)
+        return wait
+
+    def _prune(self, now: float, rate: float, burst: int):
+        # Полные корзины ничем не отличаются от отсутствующих
+        self._buckets = {
+            scope: (tokens, updated_at) for scope, (tokens, updated_at) in self._buckets.items()
+            if tokens + (now - updated_at) * rate < burst
+        }
+
+
+class RedisRateLimiter:
+    """Token buckets shared by every API process through Redis"""
+
+    def __init__(self, client, prefix: str = "admission"):
+        self.redis = client
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def hit(self, scope: str, rate: float, burst: int) -> float:
+        wait = await self._script(keys=[f"{self.prefix}:{scope}"], args=[rate, burst, time.time()])
+        return float(wait)
+
+
+class AdmissionController:
+    """Admission control for the ingestion endpoints.
+
+    A request is rejected with a retry delay when its bot or the whole API
+    is over its rate, or when too much ingestion work is already in flight:
+    requests being handled plus events not delivered yet, in process or in
+    the Redis stream consumer group.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.in_flight = 0
+
+    async def check(self, bot_id: Optional[str]) -> Optional[float]:
+        """Return seconds the client should wait, or None if the request is admitted"""
+        if self.in_flight + await event_bus.backlog() >= settings.INGEST_MAX_IN_FLIGHT:
+            return 1.0
+
+        # Сначала лимит бота, чтобы шумный клиент не расходовал общий бюджет
+        if bot_id and settings.INGEST_RATE_PER_BOT > 0:
+            wait = await self.limiter.hit(f"bot:{bot_id}", settings.INGEST_RATE_PER_BOT, settings.INGEST_BURST_PER_BOT)
+            if wait > 0:
+                return wait
+        if settings.INGEST_RATE_GLOBAL > 0:
+            wait = await self.limiter.hit(GLOBAL_SCOPE, settings.INGEST_RATE_GLOBAL, settings.INGEST_BURST_GLOBAL)
+            if wait > 0:
+                return wait
+        return None
+
+    @staticmethod
+    def retry_after(wait: float) -> str:
+        return str(max(1, math.ceil(wait)))
+
+
+def create_admission_controller() -> AdmissionController:
+    """Create the admission controller selected by ``ADMISSION_BACKEND``"""
+    backend = settings.ADMISSION_BACKEND or ("redis" if redis_client else "memory")
+    if backend == "redis":
+        if not redis_client:
+            raise RuntimeError("ADMISSION_BACKEND=redis requires REDIS_URL to be set")
+        limiter = RedisRateLimiter(redis_client)
+    elif backend == "memory":
+        limiter = MemoryRateLimiter()
+    else:
+        raise ValueError(f"Unknown admission backend: {backend}")
+    logger.info(f"Using {backend} admission control")
+    return AdmissionController(limiter)
+
+
+# Create global admission controller instance
+admission = create_admission_controller()
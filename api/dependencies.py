@@ -1,15 +1,11 @@
 from fastapi import Depends, HTTPException, Request
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
 from contextlib import asynccontextmanager
 
+from api.admission import admission
 from core.config import settings
 from core.logger import logger
-
-
-# Database setup
-engine = create_async_engine(settings.DATABASE_URL)
-async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+from core.shutdown import drain
+from db.session import async_session
 
 
 async def get_db():
@@ -23,4 +19,40 @@ async def get_db():
 async def verify_secret_key(request: Request):
     if request.headers.get('X-Auth-Key') != settings.API_SECRET.get_secret_value():
         logger.warning(f"Invalid auth key attempt from {request.client.host}")
-        raise HTTPException(status_code=403, detail="Invalid auth key") 
\ No newline at end of file
+        raise HTTPException(status_code=403, detail="Invalid auth key")
+
+
+async def reject_while_draining():
+    """Refuse requests that publish events with 503 once the service is draining"""
+    if drain.closed:
+        raise HTTPException(
+            status_code=503,
+            detail="Service is shutting down",
+            headers={"Retry-After": str(settings.SHUTDOWN_RETRY_AFTER)}
+        )
+
+
+async def admit_ingestion(request: Request):
+    """Reject ingestion requests over the rate or in-flight limits with 429"""
+    await reject_while_draining()
+
+    try:
+        body = await request.json()
+    except Exception:
+        body = None
+    bot_id = body.get("bot_id") if isinstance(body, dict) else None
+
+    wait = await admission.check(bot_id if isinstance(bot_id, str) else None)
+    if wait is not None:
+        logger.warning(f"Ingestion request for bot {bot_id} rejected, retry in {wait:.2f}s")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": admission.retry_after(wait)}
+        )
+
+    admission.in_flight += 1
+    try:
+        yield
+    finally:
+        admission.in_flight -= 1
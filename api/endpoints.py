@@ -1,34 +1,43 @@
-import tempfile
-
-import qrcode
-from aiogram.types import FSInputFile
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-import base64
 
-from api.dependencies import get_db, verify_secret_key
+from api.dependencies import get_db, verify_secret_key, admit_ingestion, reject_while_draining
 from api.schemas import (
     WhatsAppQRUpdate, BotCreate, BotResponse, HealthCheck,
     WhatsAppBotRegisterRequest, WhatsAppBotCheckRegisterRequest,
     WhatsAppBotUpdateQRRequest, WhatsAppBotAuthedStateRequest,
-    WhatsAppBotResponse,
+    WhatsAppBotHeartbeatRequest, WhatsAppBotResponse,
     CustomNotificationRequest
 )
 from db.repository import BotRepository, UserRepository
-from bot.services.qr_manager import QRManager
-from bot.services.bot_connector import bot_connector
+from bot.services.presence import presence, report_seen
+from bot.services.qr_renderer import qr_renderer, FORMATS
+from core.config import settings
+from core.shutdown import drain
+from core.events import event_bus, BotRegistered, QrRotated, BotAuthed, BotDeauthed, CustomNotify
+from bot.services.state_store import state_store, AUTH_NOTIFICATIONS
 from core.logger import logger
 
 router = APIRouter()
 
 
 @router.get("/status", response_model=HealthCheck)
-async def health_check():
-    """Health check endpoint"""
+async def health_check(response: Response):
+    """Health check endpoint, 503 while draining so load balancers stop routing here"""
+    if drain.closed:
+        response.status_code = 503
+        return HealthCheck(status="draining")
     return HealthCheck()
 
 
-@router.post("/qr_update", dependencies=[Depends(verify_secret_key)])
+@router.post("/drain", dependencies=[Depends(verify_secret_key)])
+async def start_drain():
+    """Close ingestion ahead of a restart, deliveries keep running until shutdown"""
+    drain.close()
+    return {"status": "draining"}
+
+
+@router.post("/qr_update", dependencies=[Depends(verify_secret_key), Depends(admit_ingestion)])
 async def handle_qr_update(
         data: WhatsAppQRUpdate,
         db: AsyncSession = Depends(get_db)
@@ -41,7 +50,9 @@ async def handle_qr_update(
         raise HTTPException(status_code=404, detail="Bot not found")
 
     await repo.update_qr(data.bot_id, data.qr_data)
-    await QRManager.notify_subscribed_users(data.bot_id, db, bot_connector.bot)
+    qr_renderer.set_current(data.bot_id, data.qr_data)
+    await report_seen(data.bot_id, authed=False, qr_rotated=True)
+    await event_bus.publish(QrRotated(bot_id=data.bot_id, qr_data=data.qr_data))
 
     logger.info(f"QR updated for bot {data.bot_id}")
     return {"status": "success"}
@@ -69,7 +80,7 @@ async def create_bot(
 
 
 # New WhatsApp bot integration endpoints
-@router.post("/whatsapp/register", response_model=WhatsAppBotResponse)
+@router.post("/whatsapp/register", response_model=WhatsAppBotResponse, dependencies=[Depends(reject_while_draining)])
 async def whatsapp_bot_register(
         data: WhatsAppBotRegisterRequest,
         db: AsyncSession = Depends(get_db)
@@ -80,27 +91,56 @@ async def whatsapp_bot_register(
     # Use the provided bot_id
     bot_id = data.bot.id
 
-    # Check if bot already exists
-    existing_bot = await repo.get_bot(bot_id)
-    if existing_bot:
+    # Create new bot, a concurrent registration of the same ID loses cleanly
+    created = await repo.create_bot_if_absent(
+        bot_id=bot_id,
+        name=data.bot.name,
+        description=data.bot.description
+    )
+    if not created:
         return WhatsAppBotResponse(
             success=False,
             message="Bot already registered",
             data={"bot_id": bot_id}
         )
 
-    # Create new bot
-    bot = await repo.create_bot(
-        bot_id=bot_id,
+    await event_bus.publish(BotRegistered(bot_id=bot_id, name=data.bot.name))
+
+    logger.info(f"Registered new WhatsApp bot: {bot_id}")
+    return WhatsAppBotResponse(
+        success=True,
+        message="Bot registered successfully",
+        data={"bot_id": bot_id, "name": data.bot.name}
+    )
+
+
+@router.post("/whatsapp/ensure_register", response_model=WhatsAppBotResponse, dependencies=[Depends(reject_while_draining)])
+async def whatsapp_bot_ensure_register(
+        data: WhatsAppBotRegisterRequest,
+        db: AsyncSession = Depends(get_db)
+):
+    """Register the WhatsApp bot or refresh its details, in a single round trip"""
+    repo = BotRepository(db)
+    bot, created = await repo.upsert_bot(
+        bot_id=data.bot.id,
         name=data.bot.name,
         description=data.bot.description
     )
 
-    logger.info(f"Registered new WhatsApp bot: {bot.id}")
+    if created:
+        await event_bus.publish(BotRegistered(bot_id=bot.id, name=bot.name))
+        logger.info(f"Registered new WhatsApp bot: {bot.id}")
+
     return WhatsAppBotResponse(
         success=True,
-        message="Bot registered successfully",
-        data={"bot_id": bot.id, "name": bot.name}
+        message="Bot registered successfully" if created else "Bot is registered",
+        data={
+            "bot_id": bot.id,
+            "name": bot.name,
+            "description": bot.description,
+            "authed": bot.authed,
+            "created": created
+        }
     )
 
 
@@ -132,7 +172,7 @@ async def whatsapp_bot_check_register(
     )
 
 
-@router.post("/whatsapp/update_qr", response_model=WhatsAppBotResponse)
+@router.post("/whatsapp/update_qr", response_model=WhatsAppBotResponse, dependencies=[Depends(admit_ingestion)])
 async def whatsapp_bot_update_qr(
         data: WhatsAppBotUpdateQRRequest,
         db: AsyncSession = Depends(get_db)
@@ -153,7 +193,9 @@ async def whatsapp_bot_update_qr(
 
     # Сохраняем QR код
     await repo.update_qr(data.bot_id, qr_data)
-    await QRManager.notify_subscribed_users(data.bot_id, db, bot_connector.bot)
+    qr_renderer.set_current(data.bot_id, qr_data)
+    await report_seen(data.bot_id, authed=False, qr_rotated=True)
+    await event_bus.publish(QrRotated(bot_id=data.bot_id, qr_data=qr_data))
 
     logger.info(f"QR updated for WhatsApp bot: {data.bot_id}")
     return WhatsAppBotResponse(
@@ -163,14 +205,13 @@ async def whatsapp_bot_update_qr(
     )
 
 
-@router.post("/whatsapp/update_auth_state", response_model=WhatsAppBotResponse)
+@router.post("/whatsapp/update_auth_state", response_model=WhatsAppBotResponse, dependencies=[Depends(reject_while_draining)])
 async def whatsapp_bot_update_auth_state(
         data: WhatsAppBotAuthedStateRequest,
         db: AsyncSession = Depends(get_db)
 ):
     """Update authentication state for WhatsApp bot"""
     repo = BotRepository(db)
-    user_repo = UserRepository(db)
     bot = await repo.get_bot(data.bot_id)
 
     if not bot:
@@ -181,26 +222,22 @@ async def whatsapp_bot_update_auth_state(
         )
     previous_authed = bot.authed
 
-    # Update authentication state
+    # Update authentication state, QR and notification flags in one transaction
     authed = data.state == "authed"
-    await repo.update_auth_state(data.bot_id, authed)
+    await repo.update_auth_state(data.bot_id, authed, commit=False)
+    if authed:
+        await repo.delete_qr(data.bot_id, commit=False)
+    elif previous_authed != authed:
+        await state_store.clear_flags(AUTH_NOTIFICATIONS, data.bot_id, db=db)
+    await db.commit()
+    if authed:
+        qr_renderer.set_current(data.bot_id, None)
+    await report_seen(data.bot_id, authed=authed)
 
     if authed and (previous_authed != authed):
-        await QRManager.notify_auth_success(data.bot_id, db, bot_connector.bot)
+        await event_bus.publish(BotAuthed(bot_id=data.bot_id))
     elif not authed and (previous_authed != authed):
-        await QRManager.notify_deauth_success(data.bot_id, db, bot_connector.bot)
-
-        users = await user_repo.get_users_linked_to_bot(bot.id)
-        for user in users:
-            u_data = user.data or {}
-            new_auth_notifications_sent = u_data["auth_notifications_sent"]
-            new_auth_notifications_sent.pop(data.bot_id, None)
-            u_data["auth_notifications_sent"] = new_auth_notifications_sent
-            user.data = u_data
-            await user_repo.update_user_data(user.tg_id, u_data)
-
-    if authed:
-        await repo.delete_qr(data.bot_id)
+        await event_bus.publish(BotDeauthed(bot_id=data.bot_id))
 
     logger.info(f"Authentication state updated for WhatsApp bot: {data.bot_id}")
 
@@ -211,14 +248,36 @@ async def whatsapp_bot_update_auth_state(
     )
 
 
-@router.post("/whatsapp/notify", response_model=WhatsAppBotResponse)
+@router.post("/whatsapp/heartbeat", response_model=WhatsAppBotResponse)
+async def whatsapp_bot_heartbeat(
+        data: WhatsAppBotHeartbeatRequest,
+        db: AsyncSession = Depends(get_db)
+):
+    """Record that the WhatsApp bot process is alive"""
+    # База нужна только для первого heartbeat бота, дальше хватает таблицы присутствия
+    if not presence.tracks(data.bot_id) and not await BotRepository(db).get_bot(data.bot_id):
+        return WhatsAppBotResponse(
+            success=False,
+            message="Bot not found",
+            data={"bot_id": data.bot_id}
+        )
+
+    authed = None if data.state is None else data.state == "authed"
+    await report_seen(data.bot_id, authed=authed, heartbeat=True)
+    return WhatsAppBotResponse(
+        success=True,
+        message="Heartbeat received",
+        data={"bot_id": data.bot_id}
+    )
+
+
+@router.post("/whatsapp/notify", response_model=WhatsAppBotResponse, dependencies=[Depends(admit_ingestion)])
 async def whatsapp_bot_custom_notify(
         data: CustomNotificationRequest,
         db: AsyncSession = Depends(get_db)
 ):
     """Send custom notification from WhatsApp bot to Telegram users"""
     user_repo = UserRepository(db)
-    bot_repo = BotRepository(db)
 
     try:
         # Определяем, кому отправлять уведомление
@@ -239,27 +298,18 @@ async def whatsapp_bot_custom_notify(
                 data={"bot_id": data.bot_id}
             )
 
-        for user in users_to_notify:
-            try:
-                message_text = f"**📢 Custom Notification from {data.sender_name}**\n\n{data.message}"
-                if data.bot_id:
-                    bot_info = await bot_repo.get_bot(data.bot_id)
-                    if bot_info:
-                        message_text = f"**📢 Custom Notification from Bot {bot_info.name} ({data.sender_name})**\n\n{data.message}"
-
-                await bot_connector.bot.send_message(
-                    chat_id=user.tg_id,
-                    text=message_text,
-                    parse_mode="Markdown"
-                )
-                logger.info(f"Sent custom notification to user {user.tg_id} from {data.sender_name}")
-            except Exception as e:
-                logger.error(f"Failed to send custom notification to user {user.tg_id}: {e}")
+        # Доставка (и сборка дайджестов) идет в подписчиках шины событий
+        await event_bus.publish(CustomNotify(
+            bot_id=data.bot_id,
+            sender_name=data.sender_name,
+            message=data.message,
+            urgent=data.urgent
+        ))
 
         return WhatsAppBotResponse(
             success=True,
             message="Custom notification sent successfully",
-            data={"bot_id": data.bot_id}
+            data={"bot_id": data.bot_id, "recipients": len(users_to_notify)}
         )
     except Exception as e:
         logger.error(f"Error in custom notification endpoint: {e}")
@@ -268,3 +318,68 @@ async def whatsapp_bot_custom_notify(
             message=f"Internal server error: {str(e)}",
             data={}
         )
+
+
+def _qr_etag(fmt: str, payload_hash: str) -> str:
+    return f'"{fmt}-{payload_hash[:32]}"'
+
+
+def _etag_matches(etag: str, if_none_match: str) -> bool:
+    """Weak comparison of If-None-Match against the ETag (RFC 9110)"""
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+async def _serve_qr_image(bot_id: str, fmt: str, request: Request, db: AsyncSession) -> Response:
+    """Serve the current QR of the bot with a strong ETag, 304 on unchanged polls"""
+    if_none_match = request.headers.get("if-none-match", "")
+
+    # Опрос неизменившегося QR отвечаем по хэшу из памяти, не читая бота из БД
+    payload_hash = qr_renderer.current_hash(bot_id)
+    if if_none_match and payload_hash:
+        etag = _qr_etag(fmt, payload_hash)
+        if _etag_matches(etag, if_none_match):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+    repo = BotRepository(db)
+    bot = await repo.get_bot(bot_id)
+    if not bot:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    qr_renderer.set_current(bot_id, bot.current_qr)
+    if not bot.current_qr:
+        raise HTTPException(status_code=404, detail="No QR code available")
+
+    etag = _qr_etag(fmt, qr_renderer.payload_hash(bot.current_qr))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+
+    image = await qr_renderer.render_async(bot.current_qr, fmt)
+    return Response(content=image, media_type=FORMATS[fmt], headers=headers)
+
+
+@router.get("/whatsapp/{bot_id}/qr.png", dependencies=[Depends(verify_secret_key)])
+async def whatsapp_bot_qr_png(
+        bot_id: str,
+        request: Request,
+        db: AsyncSession = Depends(get_db)
+):
+    """Current QR code of the WhatsApp bot as PNG"""
+    return await _serve_qr_image(bot_id, settings.QR_API_PNG_FORMAT, request, db)
+
+
+@router.get("/whatsapp/{bot_id}/qr.svg", dependencies=[Depends(verify_secret_key)])
+async def whatsapp_bot_qr_svg(
+        bot_id: str,
+        request: Request,
+        db: AsyncSession = Depends(get_db)
+):
+    """Current QR code of the WhatsApp bot as SVG"""
+    return await _serve_qr_image(bot_id, "svg", request, db)
@@ -0,0 +1,175 @@
+import base64
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+from core.config import settings
+from core.logger import logger
+from core.redis import redis_client
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# Record states returned by IdempotencyStore.begin
+NEW = "new"
+PENDING = "pending"
+DONE = "done"
+
+
+class MemoryIdempotencyStore:
+    """Idempotency records kept in the API process"""
+
+    def __init__(self):
+        self._records: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    def _get(self, key: str) -> Optional[dict]:
+        now = time.monotonic()
+        # Записи добавляются по порядку, поэтому просроченные копятся в начале
+        while self._records and next(iter(self._records.values()))[0] <= now:
+            self._records.popitem(last=False)
+        entry = self._records.get(key)
+        return entry[1] if entry and entry[0] > now else None
+
+    def _set(self, key: str, record: dict, ttl: int):
+        self._records.pop(key, None)
+        self._records[key] = (time.monotonic() + ttl, record)
+
+    async def begin(self, key: str, fingerprint: str) -> Tuple[str, Optional[dict]]:
+        """Reserve the key, or return the state of an existing reservation"""
+        record = self._get(key)
+        if record is None:
+            self._set(key, {"fingerprint": fingerprint}, settings.IDEMPOTENCY_LOCK_TTL)
+            return NEW, None
+        return (DONE if "status" in record else PENDING), record
+
+    async def complete(self, key: str, record: dict):
+        self._set(key, record, settings.IDEMPOTENCY_TTL)
+
+    async def release(self, key: str):
+        self._records.pop(key, None)
+
+
+class RedisIdempotencyStore:
+    """Idempotency records shared by every API process through Redis"""
+
+    def __init__(self, client, prefix: str = "idempotency"):
+        self.redis = client
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    async def begin(self, key: str, fingerprint: str) -> Tuple[str, Optional[dict]]:
+        reserved = await self.redis.set(
+            self._key(key), json.dumps({"fingerprint": fingerprint}),
+            nx=True, ex=settings.IDEMPOTENCY_LOCK_TTL
+        )
+        if reserved:
+            return NEW, None
+        value = await self.redis.get(self._key(key))
+        if value is None:
+            # Резерв истек между SET и GET - пробуем еще раз
+            return await self.begin(key, fingerprint)
+        record = json.loads(value)
+        return (DONE if "status" in record else PENDING), record
+
+    async def complete(self, key: str, record: dict):
+        await self.redis.set(self._key(key), json.dumps(record), ex=settings.IDEMPOTENCY_TTL)
+
+    async def release(self, key: str):
+        await self.redis.delete(self._key(key))
+
+
+def create_idempotency_store():
+    """Create the idempotency store selected by ``IDEMPOTENCY_BACKEND``"""
+    backend = settings.IDEMPOTENCY_BACKEND or ("redis" if redis_client else "memory")
+    if backend == "redis":
+        if not redis_client:
+            raise RuntimeError("IDEMPOTENCY_BACKEND=redis requires REDIS_URL to be set")
+        return RedisIdempotencyStore(redis_client)
+    if backend == "memory":
+        return MemoryIdempotencyStore()
+    raise ValueError(f"Unknown idempotency backend: {backend}")
+
+
+# Create global idempotency store instance
+idempotency_store = create_idempotency_store()
+
+
+class IdempotencyMiddleware(BaseHTTPMiddleware):
+    """Replays stored responses for repeated ``Idempotency-Key`` requests.
+
+    Applies to POST requests under ``path_prefix``. The first request with a
+    key runs normally and its response (anything but a 5xx) is kept for
+    ``IDEMPOTENCY_TTL``; retries get that response back without running the
+    endpoint again. A retry arriving while the first request still runs gets
+    409, and reusing a key with a different body gets 422.
+    """
+
+    def __init__(self, app, path_prefix: str = "/api/whatsapp/"):
+        super().__init__(app)
+        self.path_prefix = path_prefix
+
+    async def dispatch(self, request: Request, call_next) -> Response:
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if (
+            not idempotency_key
+            or request.method != "POST"
+            or not request.url.path.startswith(self.path_prefix)
+        ):
+            return await call_next(request)
+
+        key = f"{request.url.path}:{idempotency_key}"
+        fingerprint = hashlib.sha256(await request.body()).hexdigest()
+        state, record = await idempotency_store.begin(key, fingerprint)
+
+        if state != NEW and record["fingerprint"] != fingerprint:
+            return JSONResponse(
+                status_code=422,
+                content={"detail": "Idempotency-Key was already used with a different request body"}
+            )
+        if state == PENDING:
+            return JSONResponse(
+                status_code=409,
+                content={"detail": "A request with this Idempotency-Key is still in progress"},
+                headers={"Retry-After": "1"}
+            )
+        if state == DONE:
+            logger.debug(f"Replaying stored response for {key}")
+            return Response(
+                content=base64.b64decode(record["body"]),
+                status_code=record["status"],
+                media_type=record["media_type"],
+                headers={REPLAYED_HEADER: "true"}
+            )
+
+        try:
+            response = await call_next(request)
+            body = b"".join([chunk async for chunk in response.body_iterator])
+        except Exception:
+            await idempotency_store.release(key)
+            raise
+
+        if response.status_code >= 500 or response.status_code == 429:
+            # Ошибку сервера или отказ по лимиту клиент должен иметь возможность повторить
+            await idempotency_store.release(key)
+        else:
+            await idempotency_store.complete(key, {
+                "fingerprint": fingerprint,
+                "status": response.status_code,
+                "media_type": response.media_type or response.headers.get("content-type"),
+                "body": base64.b64encode(body).decode(),
+            })
+
+        return Response(
+            content=body,
+            status_code=response.status_code,
+            headers=dict(response.headers),
+            media_type=response.media_type
+        )
@@ -57,6 +57,11 @@ class WhatsAppBotAuthedStateRequest(BaseModel):
     state: str = Field(..., pattern="^(authed|not_authed)$")
 
 
+class WhatsAppBotHeartbeatRequest(BaseModel):
+    bot_id: str = Field(..., min_length=32, max_length=32)
+    state: Optional[str] = Field(None, pattern="^(authed|not_authed)$")
+
+
 class WhatsAppBotResponse(BaseModel):
     success: bool
     message: str
@@ -68,12 +73,14 @@ class CustomNotificationRequest(BaseModel):
     message: str = Field(..., description="The message to send")
     sender_name: str = Field("WhatsApp Bot", description="Name of the sender (e.g., 'WhatsApp Bot', 'John Doe')")
     bot_id: str = Field(..., description="The ID of the WhatsApp bot sending the notification")
+    urgent: bool = Field(False, description="Send right away, bypassing the digest window")
 
     class Config:
         json_schema_extra = {
             "example": {
                 "message": "Hello from your WhatsApp bot!",
                 "sender_name": "My Awesome WhatsApp Bot",
-                "bot_id": "my_whatsapp_bot_id"
+                "bot_id": "my_whatsapp_bot_id",
+                "urgent": False
             }
         } 
\ No newline at end of file
@@ -1,15 +1,12 @@
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, FSInputFile
-from sqlalchemy import text
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InputMediaPhoto
 from sqlalchemy.ext.asyncio import AsyncSession
-import base64
-from io import BytesIO
-import tempfile
-import os
-import qrcode
-from PIL import Image
-
-from db.repository import BotRepository, UserRepository
+
+from db.repository import BotRepository
+from bot.services.qr_manager import QRManager
+from bot.services.qr_renderer import qr_renderer
+from bot.handlers.commands import send_unlinked_bots
 from core.logger import logger
 
 router = Router()
@@ -38,7 +35,6 @@ async def handle_auth_qr(callback: CallbackQuery, db: AsyncSession):
     """Handle auth QR request callback"""
     bot_id = callback.data.split(":")[1]
     bot_repo = BotRepository(db)
-    user_repo = UserRepository(db)
     
     bot = await bot_repo.get_bot(bot_id)
     if not bot:
@@ -52,62 +48,66 @@ async def handle_auth_qr(callback: CallbackQuery, db: AsyncSession):
     try:
         # Используем данные QR напрямую из БД, без перекодирований
         qr_data_string = bot.current_qr
-        print(f"DEBUG: QR data string being used for generation: {qr_data_string}")
 
-        last_message = await user_repo.get_qr_message(callback.from_user.id, bot_id)
-        #ЗДЕСЬ Я ХОЧУ УДАЛИТЬ СООБЩЕНИЕ ПО ЕГО ID 
+        last_message = await QRManager.get_last_qr_message(callback.from_user.id, bot_id)
+        caption = f"🔐 QR Code for {bot.name}\n\nScan this QR code with WhatsApp to authenticate your bot."
+
+        # QR обычно уже отрисован (или загружен) в фоне при ротации
+        qr_photo = await qr_renderer.telegram_photo(qr_data_string, callback.bot)
+
         if last_message:
+            # Правим прежнее сообщение на месте: один вызов вместо удаления и новой отправки
             try:
-                print("Deleting message: ", last_message, "in chat: ", callback.from_user.id)
-                await callback.message.bot.delete_message(chat_id=callback.from_user.id, message_id=last_message)
+                edited = await callback.bot.edit_message_media(
+                    chat_id=callback.from_user.id,
+                    message_id=last_message,
+                    media=InputMediaPhoto(media=qr_photo, caption=caption)
+                )
+                if not isinstance(qr_photo, str) and getattr(edited, "photo", None):
+                    qr_renderer.remember_file_id(qr_data_string, callback.bot, edited.photo[-1].file_id)
+                # Отсчет возраста сообщения для сборщика начинается заново
+                await QRManager.set_last_qr_message(callback.from_user.id, bot_id, last_message)
+                await callback.answer("✅ QR code updated!")
+                return
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    await QRManager.set_last_qr_message(callback.from_user.id, bot_id, last_message)
+                    await callback.answer("✅ QR code is up to date")
+                    return
+                logger.warning(f"Could not edit QR message {last_message}, sending a new one: {e}")
+            try:
+                await callback.bot.delete_message(chat_id=callback.from_user.id, message_id=last_message)
             except Exception as e:
                 logger.warning(f"Не удалось удалить предыдущее сообщение с QR: {e}")
 
-        
-        # Создаем QR код из данных (строки)
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
+        # Отправляем QR код
+        message = await callback.message.answer_photo(
+            photo=qr_photo,
+            caption=caption
         )
-        qr.add_data(qr_data_string) # <-- Здесь передаем чистую строку из БД
-        qr.make(fit=True)
-        
-        # Создаем изображение QR кода
-        qr_image = qr.make_image(fill_color="black", back_color="white")
-        
-        # Сохраняем во временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-            qr_image.save(temp_file.name)
-            temp_file_path = temp_file.name
-        
-        try:
-            # Создаем FSInputFile из временного файла
-            qr_file = FSInputFile(temp_file_path)
-            
-            # Отправляем QR код
-            message = await callback.message.answer_photo(
-                photo=qr_file,
-                caption=f"🔐 QR Code for {bot.name}\n\nScan this QR code with WhatsApp to authenticate your bot."
-            )
-            print(message.json())
-            # Сохраняем ID сообщения в БД
-            await user_repo.set_qr_message(callback.from_user.id, bot_id, message.message_id)
-            await callback.answer("✅ QR code sent!")
-            
-        finally:
-            # Удаляем временный файл
-            try:
-                os.unlink(temp_file_path)
-            except Exception as e:
-                logger.error(f"Error deleting temporary file: {e}")
+        if message.photo:
+            qr_renderer.remember_file_id(qr_data_string, callback.bot, message.photo[-1].file_id)
+        # Сохраняем ID сообщения в БД
+        await QRManager.set_last_qr_message(callback.from_user.id, bot_id, message.message_id)
+        await callback.answer("✅ QR code sent!")
         
     except Exception as e:
         logger.error(f"Error sending QR code: {e}")
         await callback.answer("❌ Error sending QR code", show_alert=True)
 
 
+@router.callback_query(F.data == "auth_all")
+async def handle_auth_all(callback: CallbackQuery, db: AsyncSession):
+    """Handle the "Auth all" button of /list_bots"""
+    try:
+        sent = await QRManager.send_qr_albums(callback.from_user.id, db, callback.bot)
+    except Exception as e:
+        logger.error(f"Error sending QR albums: {e}")
+        await callback.answer("❌ Error sending QR codes", show_alert=True)
+        return
+    await callback.answer(f"✅ Sent {sent} QR codes!" if sent else "No bots are waiting for a QR scan")
+
+
 @router.callback_query(F.data.startswith("unlink:"))
 async def handle_unlink_bot(callback: CallbackQuery, db: AsyncSession):
     """Handle bot unlinking callback"""
@@ -115,13 +115,18 @@ async def handle_unlink_bot(callback: CallbackQuery, db: AsyncSession):
     bot_repo = BotRepository(db)
     
     # Remove association between user and bot
-    result = await db.execute(
-        text("DELETE FROM users_bots_mul WHERE user_id = :user_id AND bot_id = :bot_id"),
-        {"user_id": callback.from_user.id, "bot_id": bot_id},
-    )
-    await db.commit()
+    unlinked = await bot_repo.unlink_bots_from_user(callback.from_user.id, [bot_id])
     
-    if result.rowcount > 0:
+    if unlinked:
+        # Убираем QR сообщение отвязанного бота, чтобы не оставлять мертвых ссылок
+        last_message = await QRManager.get_last_qr_message(callback.from_user.id, bot_id)
+        if last_message:
+            try:
+                await callback.message.bot.delete_message(chat_id=callback.from_user.id, message_id=last_message)
+            except Exception as e:
+                logger.warning(f"Не удалось удалить сообщение с QR при отвязке: {e}")
+            await QRManager.delete_last_qr_message(callback.from_user.id, bot_id)
+
         await callback.answer("✅ Bot unlinked successfully!")
         await callback.message.edit_text(
             f"✅ Bot {bot_id[:6]}... has been unlinked from your account."
@@ -129,4 +134,13 @@ async def handle_unlink_bot(callback: CallbackQuery, db: AsyncSession):
         logger.info(f"Bot {bot_id} unlinked from user {callback.from_user.id}")
     else:
         await callback.answer("❌ Failed to unlink bot", show_alert=True)
-        logger.error(f"Failed to unlink bot {bot_id} to user {callback.from_user.id}") 
\ No newline at end of file
+        logger.error(f"Failed to unlink bot {bot_id} to user {callback.from_user.id}")
+
+
+@router.callback_query(F.data.startswith("unlinked_page:"))
+async def handle_unlinked_page(callback: CallbackQuery, db: AsyncSession):
+    """Handle the next page of /list_unlinked_bots"""
+    after = callback.data.split(":", 1)[1]
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await send_unlinked_bots(callback.message, BotRepository(db), callback.from_user.id, after=after)
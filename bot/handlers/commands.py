@@ -4,11 +4,15 @@ from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from bot.services.presence import presence
+from bot.services.qr_manager import QRManager
 from db.repository import BotRepository, UserRepository
 from core.logger import logger
 
 router = Router()
 
+UNLINKED_PAGE_SIZE = 10  # bots per /list_unlinked_bots page
+
 
 @router.message(Command("start"))
 async def cmd_start(message: Message, db: AsyncSession):
@@ -30,8 +34,12 @@ async def cmd_help(message: Message):
         "📚 Available commands:\n\n"
         "/list_bots - Show your linked bots\n"
         "/list_unlinked_bots - Show available bots to link\n"
+        "/auth_all - Get QR codes of all your unauthenticated bots at once\n"
+        "/digest <seconds|off> - Bundle bot notifications into one message per window\n"
         "/help - Show this help message\n"
-        "/invite <user_id> - Add a user to the bot (Admin only)"
+        "/invite <user_id> - Add a user to the bot (Admin only)\n"
+        "/link_bots <user_id> <bot_id> ... - Link bots to a user (Admin only)\n"
+        "/unlink_bots <user_id> <bot_id> ... - Unlink bots from a user (Admin only)"
     )
     await message.answer(help_text)
 
@@ -55,8 +63,14 @@ async def cmd_list_bots(message: Message, db: AsyncSession):
         "Status indicators:\n"
         "✅ Authenticated - Bot is ready to use\n"
         "❌ Not authenticated - Needs QR code scan\n"
+        "🟢 Online / 🔴 Silent - Whether the bot process still sends heartbeats\n"
     )
-    await message.answer(header_text, parse_mode="HTML")
+    header_kb = None
+    if sum(not bot.authed for bot in bots) > 1:
+        kb = InlineKeyboardBuilder()
+        kb.button(text="🔐 Auth all", callback_data="auth_all")
+        header_kb = kb.as_markup()
+    await message.answer(header_text, reply_markup=header_kb, parse_mode="HTML")
     
     # Send each bot in a separate message
     for bot in bots:
@@ -68,7 +82,8 @@ async def cmd_list_bots(message: Message, db: AsyncSession):
             f"🤖 <b>{bot.name}</b>\n\n"
             f"<code>ID: {bot.id}</code>\n"
             f"📝 <i>{bot.description}</i>\n\n"
-            f"{status_emoji} <b>Status:</b> {status_text}"
+            f"{status_emoji} <b>Status:</b> {status_text}\n"
+            f"{presence.status(bot)}"
         )
         
         # Create inline keyboard with buttons
@@ -93,12 +108,12 @@ async def cmd_list_bots(message: Message, db: AsyncSession):
         )
 
 
-@router.message(Command("list_unlinked_bots"))
-async def cmd_list_unlinked_bots(message: Message, db: AsyncSession):
-    """Handle /list_unlinked_bots command"""
-    bot_repo = BotRepository(db)
-    bots = await bot_repo.get_unlinked_bots(message.from_user.id)
-    
+async def send_unlinked_bots(message: Message, bot_repo: BotRepository, user_id: int, after: str = None):
+    """Send one page of bots available to link, with a button for the next page"""
+    bots = await bot_repo.get_unlinked_bots(user_id, after=after, limit=UNLINKED_PAGE_SIZE + 1)
+    has_more = len(bots) > UNLINKED_PAGE_SIZE
+    bots = bots[:UNLINKED_PAGE_SIZE]
+
     if not bots:
         await message.answer("No unlinked bots available.")
         return
@@ -129,6 +144,49 @@ async def cmd_list_unlinked_bots(message: Message, db: AsyncSession):
             parse_mode="HTML"
         )
 
+    if has_more:
+        # Следующая страница начинается после последнего показанного ID (keyset)
+        kb = InlineKeyboardBuilder()
+        kb.button(text="More bots ➡️", callback_data=f"unlinked_page:{bots[-1].id}")
+        await message.answer("There are more bots available to link.", reply_markup=kb.as_markup())
+
+
+@router.message(Command("list_unlinked_bots"))
+async def cmd_list_unlinked_bots(message: Message, db: AsyncSession):
+    """Handle /list_unlinked_bots command"""
+    await send_unlinked_bots(message, BotRepository(db), message.from_user.id)
+
+
+@router.message(Command("auth_all"))
+async def cmd_auth_all(message: Message, db: AsyncSession):
+    """Handle /auth_all command"""
+    sent = await QRManager.send_qr_albums(message.from_user.id, db, message.bot)
+    if not sent:
+        await message.answer("✅ No bots are waiting for a QR scan.")
+
+
+@router.message(Command("digest"))
+async def cmd_digest(message: Message, db: AsyncSession):
+    """Handle /digest command to set the personal notification digest window"""
+    user_repo = UserRepository(db)
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2 or not (args[1].isdigit() or args[1] in ("off", "default")):
+        await message.answer("Usage: /digest <seconds> | /digest off | /digest default")
+        return
+
+    # None означает окно по умолчанию
+    if args[1] == "default":
+        window = None
+        reply = "✅ Notification digest reset to the default."
+    elif args[1] == "off" or int(args[1]) == 0:
+        window = 0
+        reply = "✅ Notifications will be delivered one by one."
+    else:
+        window = int(args[1])
+        reply = f"✅ Notifications will be bundled into one message every {args[1]} seconds."
+    await user_repo.set_data_path(["digest_window"], {message.from_user.id: window})
+    await message.answer(reply)
+
 
 @router.message(Command("invite"))
 async def cmd_invite(message: Message, db: AsyncSession):
@@ -149,9 +207,8 @@ async def cmd_invite(message: Message, db: AsyncSession):
     invited_tg_id = int(args[1])
 
     try:
-        invited_user = await user_repo.get_or_create_user(invited_tg_id)
-        invited_user.data["is_admin"] = True
-        await user_repo.update_user_data(invited_tg_id, invited_user.data)
+        await user_repo.get_or_create_user(invited_tg_id)
+        await user_repo.set_data_path(["is_admin"], {invited_tg_id: True})
         await message.answer(f"✅ User {invited_tg_id} has been successfully added to the bot.")
         
         # Уведомляем приглашенного пользователя
@@ -167,4 +224,52 @@ async def cmd_invite(message: Message, db: AsyncSession):
 
     except Exception as e:
         logger.error(f"Error inviting user {invited_tg_id}: {e}")
-        await message.answer(f"❌ An error occurred while inviting user {invited_tg_id}.") 
\ No newline at end of file
+        await message.answer(f"❌ An error occurred while inviting user {invited_tg_id}.") 
+
+
+async def _parse_bulk_link_args(message: Message, user_repo: UserRepository, usage: str):
+    """Check admin rights and parse ``<user_id> <bot_id> ...`` arguments"""
+    if not await user_repo.is_admin(message.from_user.id):
+        await message.answer("❌ You are not authorized to use this command.")
+        logger.warning(f"User {message.from_user.id} tried to use {usage.split()[0]} without admin rights.")
+        return None
+
+    args = message.text.split()[1:]
+    if len(args) < 2 or not args[0].isdigit():
+        await message.answer(f"Usage: {usage}")
+        return None
+    return int(args[0]), list(dict.fromkeys(args[1:]))
+
+
+@router.message(Command("link_bots"))
+async def cmd_link_bots(message: Message, db: AsyncSession):
+    """Handle /link_bots command to link many bots to a user at once"""
+    user_repo = UserRepository(db)
+    parsed = await _parse_bulk_link_args(message, user_repo, "/link_bots <telegram_user_id> <bot_id> [bot_id ...]")
+    if not parsed:
+        return
+    target_tg_id, bot_ids = parsed
+
+    if not await user_repo.get_user_by_tg_id(target_tg_id):
+        await message.answer(f"❌ User {target_tg_id} is not registered. Use /invite first.")
+        return
+
+    linked = await BotRepository(db).link_bots_to_user(target_tg_id, bot_ids)
+    await message.answer(
+        f"✅ Linked {linked} of {len(bot_ids)} bots to user {target_tg_id} "
+        f"(unknown or already linked bots are skipped)."
+    )
+
+
+@router.message(Command("unlink_bots"))
+async def cmd_unlink_bots(message: Message, db: AsyncSession):
+    """Handle /unlink_bots command to unlink many bots from a user at once"""
+    user_repo = UserRepository(db)
+    parsed = await _parse_bulk_link_args(message, user_repo, "/unlink_bots <telegram_user_id> <bot_id> [bot_id ...]")
+    if not parsed:
+        return
+    target_tg_id, bot_ids = parsed
+
+    # QR сообщения отвязанных ботов подчистит сборщик как осиротевшие
+    unlinked = await BotRepository(db).unlink_bots_from_user(target_tg_id, bot_ids)
+    await message.answer(f"✅ Unlinked {unlinked} of {len(bot_ids)} bots from user {target_tg_id}.")
@@ -0,0 +1,34 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery
+from sqlalchemy.orm.attributes import set_committed_value
+
+from db.repository import UserRepository
+
+# Key in User.data holding the ID of the Telegram bot the user is pinned to
+ASSIGNED_BOT_KEY = "tg_bot_id"
+
+
+class BotAssignmentMiddleware(BaseMiddleware):
+    """Pins the user to the Telegram bot token the update came from.
+
+    Runs after ``DatabaseMiddleware`` and writes only when the user switches
+    to a different bot of the pool.
+    """
+
+    def __init__(self, connector):
+        self.connector = connector
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message | CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("db_user")
+        if user is not None and self.connector.assign(user.tg_id, data["bot"]):
+            # Пишем только свой ключ, чтобы не затереть то, что рассылка успела сохранить в data
+            await UserRepository(data["db"]).set_data_path([ASSIGNED_BOT_KEY], {user.tg_id: data["bot"].id})
+            set_committed_value(user, "data", {**(user.data or {}), ASSIGNED_BOT_KEY: data["bot"].id})
+        return await handler(event, data)
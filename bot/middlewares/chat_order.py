@@ -0,0 +1,27 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from core.logger import logger
+from core.serial import KeyedSerialExecutor
+
+
+class ChatOrderMiddleware(BaseMiddleware):
+    """Outer update middleware: concurrent across chats, serial within a chat"""
+
+    def __init__(self, limit: int = 0):
+        self.executor = KeyedSerialExecutor(limit)
+        logger.info(f"Handling Telegram updates concurrently across chats (limit={limit or 'none'})")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        # event_chat/event_from_user кладет UserContextMiddleware диспетчера
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        key = chat.id if chat else (user.id if user else None)
+        return await self.executor.run(key, lambda: handler(event, data))
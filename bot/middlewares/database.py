@@ -4,7 +4,7 @@ from aiogram.types import Message, CallbackQuery
 from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 
-from api.dependencies import async_session
+from db.session import async_session
 from db.repository import UserRepository
 from db.models import User
 
@@ -40,4 +40,5 @@ class DatabaseMiddleware(BaseMiddleware):
                     await event.answer("🚫 Access Denied: This is a closed bot.", show_alert=True)
                 return
             
+            data["db_user"] = existing_user
             return await handler(event, data) 
\ No newline at end of file
@@ -0,0 +1,29 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from core.tracing import span
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Outer update middleware: every update is handled inside its own span"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        event_type = event.event_type if isinstance(event, Update) else type(event).__name__
+        with span(
+            f"telegram update {event_type}",
+            **{
+                "telegram.update_id": getattr(event, "update_id", None),
+                "telegram.chat_id": chat.id if chat else None,
+                "telegram.user_id": user.id if user else None,
+            }
+        ):
+            return await handler(event, data)
@@ -1,40 +1,230 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer, PRODUCTION
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from core.config import settings
 from core.logger import logger
-from bot.handlers import commands, callbacks
+from core.tracing import span
+from bot.middlewares.assignment import BotAssignmentMiddleware, ASSIGNED_BOT_KEY
+from bot.middlewares.chat_order import ChatOrderMiddleware
 from bot.middlewares.database import DatabaseMiddleware
+from bot.middlewares.tracing import TracingMiddleware
+from bot.services.fsm_storage import create_fsm_storage
+from bot.services.outbound import OutboundScheduler
+
+
+class TunedAiohttpSession(AiohttpSession):
+    """Aiohttp session with a configurable, long-lived connection pool"""
+
+    def __init__(
+        self,
+        pool_size: int = 100,
+        pool_per_host: int = 0,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: int = 300,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self._connector_init.update(
+            limit=pool_size,
+            limit_per_host=pool_per_host,
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=dns_cache_ttl,
+            use_dns_cache=True,
+        )
+
+
+def create_session() -> TunedAiohttpSession:
+    """Create the Telegram HTTP session from settings"""
+    api = PRODUCTION
+    if settings.BOT_API_URL:
+        api = TelegramAPIServer.from_base(settings.BOT_API_URL, is_local=settings.BOT_API_LOCAL)
+        logger.info(f"Using Bot API server at {settings.BOT_API_URL} (local={settings.BOT_API_LOCAL})")
+
+    return TunedAiohttpSession(
+        api=api,
+        timeout=settings.BOT_REQUEST_TIMEOUT,
+        pool_size=settings.BOT_SESSION_POOL_SIZE,
+        pool_per_host=settings.BOT_SESSION_POOL_PER_HOST,
+        keepalive_timeout=settings.BOT_SESSION_KEEPALIVE,
+        dns_cache_ttl=settings.BOT_SESSION_DNS_TTL,
+    )
 
 
 class BotConnector:
+    """Owns the Telegram bots and the Dispatcher.
+
+    ``BOT_TOKEN`` and every token in ``BOT_TOKENS`` get their own Bot, HTTP
+    session and outbound scheduler, so each token spends its own Telegram
+    rate limit. A user is pinned to the bot they last talked to, since chats
+    and message IDs only exist per bot; fan-out groups users by their bot
+    and sends through every bot in parallel.
+
+    Bots and Dispatcher are created on first use, so importing this module
+    stays cheap and the HTTP sessions are only opened by the process that
+    actually talks to Telegram.
+    """
+
     def __init__(self):
-        self.bot = Bot(token=settings.BOT_TOKEN.get_secret_value())
-        self.dp = Dispatcher(storage=MemoryStorage())
-        
-        # Register middleware explicitly for messages and callback queries
-        self.dp.message.middleware(DatabaseMiddleware())
-        self.dp.callback_query.middleware(DatabaseMiddleware())
-        
-        # Register handlers
-        self.dp.include_router(commands.router)
-        self.dp.include_router(callbacks.router)
+        self._bots: Optional[List[Bot]] = None
+        self._bots_by_id: Dict[int, Bot] = {}
+        self._dp: Optional[Dispatcher] = None
+        self.outbounds: List[OutboundScheduler] = []
+        self.chat_order: Optional[ChatOrderMiddleware] = None
+        self._assignments: Dict[int, int] = {}  # tg_id пользователя -> id Telegram-бота
+
+    @property
+    def bots(self) -> List[Bot]:
+        if self._bots is None:
+            tokens = [settings.BOT_TOKEN] + [token for token in settings.BOT_TOKENS if token != settings.BOT_TOKEN]
+            self._bots = []
+            for token in tokens:
+                outbound = OutboundScheduler.from_settings()
+                bot = Bot(token=token.get_secret_value(), session=create_session())
+                bot.session.middleware(outbound)
+                self.outbounds.append(outbound)
+                self._bots.append(bot)
+            self._bots_by_id = {bot.id: bot for bot in self._bots}
+            if len(self._bots) > 1:
+                logger.info(f"Using a pool of {len(self._bots)} Telegram bot tokens")
+        return self._bots
+
+    @property
+    def bot(self) -> Bot:
+        """The primary bot (``BOT_TOKEN``)"""
+        return self.bots[0]
+
+    def bot_for(self, tg_id: int) -> Bot:
+        """The bot the user is pinned to, the primary one if unknown"""
+        return self._bots_by_id.get(self._assignments.get(tg_id)) or self.bot
+
+    def group_by_bot(self, tg_ids: List[int]) -> List[Tuple[Bot, List[int]]]:
+        """Split users by the bot they are pinned to, keeping their order"""
+        groups: Dict[int, List[int]] = {}
+        for tg_id in tg_ids:
+            groups.setdefault(self.bot_for(tg_id).id, []).append(tg_id)
+        return [(self._bots_by_id[bot_id], ids) for bot_id, ids in groups.items()]
+
+    async def fan_out(self, tg_ids: List[int], send_group: Callable[[Bot, List[int]], Awaitable[None]]):
+        """Run ``send_group(bot, tg_ids)`` for every bot of the pool in parallel"""
+        groups = self.group_by_bot(tg_ids)
+
+        async def send_traced(bot: Bot, ids: List[int]):
+            # Задачи gather наследуют контекст, так что спан группы вложен в спан вызывающего
+            with span("telegram fan_out", **{"telegram.bot_id": bot.id, "telegram.recipients": len(ids)}):
+                await send_group(bot, ids)
+
+        results = await asyncio.gather(*(send_traced(bot, ids) for bot, ids in groups), return_exceptions=True)
+        for (bot, ids), result in zip(groups, results):
+            if isinstance(result, Exception):
+                logger.error(f"Delivery to {len(ids)} users through Telegram bot {bot.id} failed: {result}")
+
+    def assign(self, tg_id: int, tg_bot: Bot) -> bool:
+        """Pin the user to the bot, return True if the assignment changed and should be stored"""
+        if len(self.bots) < 2 or self._assignments.get(tg_id, self.bot.id) == tg_bot.id:
+            return False
+        self._assignments[tg_id] = tg_bot.id
+        logger.info(f"User {tg_id} moved to Telegram bot {tg_bot.id}")
+        return True
+
+    async def load_assignments(self):
+        """Restore stored user assignments, skipping bots no longer in the pool"""
+        if len(self.bots) < 2:
+            return
+        from db.repository import UserRepository
+        from db.session import async_session
+
+        async with async_session() as db:
+            users_data = await UserRepository(db).get_all_users_data()
+        self._assignments = {
+            tg_id: data[ASSIGNED_BOT_KEY]
+            for tg_id, data in users_data.items()
+            if data.get(ASSIGNED_BOT_KEY) in self._bots_by_id
+        }
+        logger.info(f"Loaded Telegram bot assignments of {len(self._assignments)} users")
+
+    @property
+    def dp(self) -> Dispatcher:
+        if self._dp is None:
+            from bot.handlers import commands, callbacks
+
+            self._dp = Dispatcher(storage=create_fsm_storage())
+
+            # One span per update, wrapping the wait for its chat's turn too
+            self._dp.update.outer_middleware(TracingMiddleware())
+            # Updates run as separate tasks: in parallel across chats, in order within one chat
+            self.chat_order = ChatOrderMiddleware(settings.BOT_UPDATE_CONCURRENCY)
+            self._dp.update.outer_middleware(self.chat_order)
+
+            # Register middleware explicitly for messages and callback queries
+            self._dp.message.middleware(DatabaseMiddleware())
+            self._dp.callback_query.middleware(DatabaseMiddleware())
+            # Pin the user to the bot token they are talking to
+            self._dp.message.middleware(BotAssignmentMiddleware(self))
+            self._dp.callback_query.middleware(BotAssignmentMiddleware(self))
+
+            # Register handlers
+            self._dp.include_router(commands.router)
+            self._dp.include_router(callbacks.router)
+        return self._dp
     
-    async def start(self):
-        """Start the bot"""
+    def prepare(self):
+        """Create the bots and Dispatcher ahead of polling"""
+        return self.bots, self.dp
+
+    async def start(self, handle_signals: bool = False):
+        """Start the bot.
+
+        Inside the API process uvicorn owns SIGINT/SIGTERM, so polling is
+        stopped by :meth:`stop_polling` during the drain. Sessions stay open
+        after polling ends, for deliveries still in flight.
+        """
         try:
             logger.info("Starting Telegram bot...")
-            await self.dp.start_polling(self.bot)
+            allowed_updates = settings.BOT_ALLOWED_UPDATES
+            if allowed_updates is None:
+                allowed_updates = self.dp.resolve_used_update_types()
+            await self.dp.start_polling(
+                *self.bots,
+                polling_timeout=settings.BOT_POLLING_TIMEOUT,
+                handle_as_tasks=True,
+                allowed_updates=allowed_updates,
+                handle_signals=handle_signals,
+                close_bot_session=False
+            )
         except Exception as e:
             logger.error(f"Failed to start bot: {e}")
             raise
-    
+
+    async def stop_polling(self):
+        """Stop fetching updates, handlers already started keep running"""
+        if self._dp is None:
+            return
+        try:
+            await self.dp.stop_polling()
+        except RuntimeError:
+            # Опрос уже остановлен (сигналом) или не запускался
+            pass
+
+    def pending_updates(self) -> int:
+        """Updates being handled or waiting for their chat's turn"""
+        return self.chat_order.executor.pending() if self.chat_order else 0
+
+    def pending_sends(self) -> int:
+        """Telegram requests waiting for a send slot, across the pool"""
+        return sum(sum(outbound.pending().values()) for outbound in self.outbounds)
+
     async def stop(self):
         """Stop the bot"""
         try:
             logger.info("Stopping Telegram bot...")
-            await self.bot.session.close()
+            await asyncio.gather(*(outbound.close() for outbound in self.outbounds))
+            for bot in self._bots or []:
+                await bot.session.close()
         except Exception as e:
             logger.error(f"Error while stopping bot: {e}")
             raise
@@ -0,0 +1,107 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.utils.markdown import hbold, html_decoration
+
+from bot.services.outbound import Lane, outbound_lane
+from core.config import settings
+from core.logger import logger
+
+
+@dataclass
+class PendingDigest:
+    """Custom notifications buffered for one user and one bot"""
+    tg_bot: object
+    bot_name: str
+    items: List[Tuple[str, str]] = field(default_factory=list)  # (sender_name, message)
+    size: int = 0
+    timer: Optional[asyncio.Task] = None
+
+
+class DigestBuffer:
+    """Coalesces custom notifications into one message per user and window.
+
+    The first notification for a (bot, user) pair opens a window; everything
+    arriving before it closes is sent as a single combined message. A window
+    is flushed early once it hits ``DIGEST_MAX_ITEMS`` or ``DIGEST_MAX_CHARS``.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[str, int], PendingDigest] = {}
+
+    @staticmethod
+    def window_for(bot_id: str, user_data: Optional[dict]) -> int:
+        """Resolve the digest window: user setting, then bot setting, then default"""
+        user_window = (user_data or {}).get("digest_window")
+        if user_window is not None:
+            return int(user_window)
+        return settings.DIGEST_BOT_WINDOWS.get(bot_id, settings.DIGEST_WINDOW)
+
+    @staticmethod
+    def _format_item(sender_name: str, message: str) -> str:
+        # Текст приходит от ботов как есть: одна лишняя * или _ ломала бы разметку всего дайджеста
+        return f"{hbold(f'{sender_name}:')} {html_decoration.quote(message)}"
+
+    async def add(self, tg_bot, bot_id: str, bot_name: str, tg_id: int, sender_name: str, message: str, window: int):
+        """Buffer a notification, flushing the window first if it would overflow"""
+        key = (bot_id, tg_id)
+        item_size = len(self._format_item(sender_name, message)) + 2
+        pending = self._pending.get(key)
+        if pending and pending.size + item_size > settings.DIGEST_MAX_CHARS:
+            await self.flush(key)
+            pending = None
+
+        if pending is None:
+            pending = PendingDigest(tg_bot=tg_bot, bot_name=bot_name)
+            pending.timer = asyncio.create_task(self._flush_later(key, window))
+            self._pending[key] = pending
+        pending.items.append((sender_name, message))
+        pending.size += item_size
+
+        if len(pending.items) >= settings.DIGEST_MAX_ITEMS:
+            await self.flush(key)
+
+    async def _flush_later(self, key: Tuple[str, int], window: int):
+        await asyncio.sleep(window)
+        await self.flush(key, from_timer=True)
+
+    async def flush(self, key: Tuple[str, int], from_timer: bool = False):
+        """Send the buffered notifications of one window"""
+        pending = self._pending.pop(key, None)
+        if not pending or not pending.items:
+            return
+        if pending.timer and not from_timer:
+            pending.timer.cancel()
+
+        bot_id, tg_id = key
+        if len(pending.items) == 1:
+            sender_name, message = pending.items[0]
+            title = hbold(f"📢 Custom Notification from Bot {pending.bot_name} ({sender_name})")
+            text = f"{title}\n\n{html_decoration.quote(message)}"
+        else:
+            lines = "\n\n".join(self._format_item(sender_name, message) for sender_name, message in pending.items)
+            title = hbold(f"📢 {len(pending.items)} Custom Notifications from Bot {pending.bot_name}")
+            text = f"{title}\n\n{lines}"
+
+        try:
+            with outbound_lane(Lane.BULK):
+                await pending.tg_bot.send_message(
+                    chat_id=tg_id,
+                    text=text,
+                    parse_mode="HTML"
+                )
+            logger.info(f"Sent digest of {len(pending.items)} notifications to user {tg_id} for bot {bot_id}")
+        except Exception as e:
+            logger.error(f"Failed to send notification digest to user {tg_id} for bot {bot_id}: {e}")
+
+    async def flush_all(self) -> int:
+        """Send every open window right away, return the number of digests sent"""
+        keys = list(self._pending)
+        for key in keys:
+            await self.flush(key)
+        return len(keys)
+
+
+# Create global digest buffer instance
+digest_buffer = DigestBuffer()
@@ -0,0 +1,41 @@
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from core.config import settings
+from core.logger import logger
+from core.redis import redis_client
+
+
+def create_fsm_storage() -> BaseStorage:
+    """Create the FSM storage selected by ``FSM_STORAGE``"""
+    backend = settings.FSM_STORAGE or ("redis" if redis_client else "memory")
+    if backend == "redis":
+        if not redis_client:
+            raise RuntimeError("FSM_STORAGE=redis requires REDIS_URL to be set")
+        # Модуль тянет redis, поэтому импортируем его только для этого бэкенда
+        from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+
+        class SharedRedisStorage(RedisStorage):
+            """Redis FSM storage on the shared client.
+
+            aiogram closes the storage when polling stops, and ``RedisStorage``
+            would close the connection pool with it while the drain still needs
+            Redis; the pool is closed once at exit instead.
+            """
+
+            async def close(self) -> None:
+                pass
+
+        storage = SharedRedisStorage(
+            redis_client,
+            # С пулом токенов у каждого бота свои чаты, поэтому id бота входит в ключ
+            key_builder=DefaultKeyBuilder(prefix="gfp:fsm", with_bot_id=True),
+            state_ttl=settings.FSM_STATE_TTL or None,
+            data_ttl=settings.FSM_DATA_TTL or None
+        )
+    elif backend == "memory":
+        storage = MemoryStorage()
+    else:
+        raise ValueError(f"Unknown FSM storage: {backend}")
+    logger.info(f"Using {backend} FSM storage")
+    return storage
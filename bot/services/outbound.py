@@ -0,0 +1,180 @@
+import asyncio
+import functools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Deque, Dict, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod, GetUpdates, GetMe, DeleteWebhook, Close, LogOut
+from aiogram.methods.base import Response, TelegramType
+
+from core.config import settings
+from core.tracing import span
+
+
+class Lane(IntEnum):
+    """Priority classes of outbound Telegram traffic"""
+    INTERACTIVE = 0  # replies to user actions: callback answers, command replies, auth QR
+    AUTH_STATE = 1  # bot authed / deauthed notifications
+    QR_ROTATION = 2  # QR message edits and auth-required notices
+    BULK = 3  # custom notify broadcasts and housekeeping
+
+
+# Methods that must never wait in a lane (long polling and service calls)
+UNSCHEDULED_METHODS = (GetUpdates, GetMe, DeleteWebhook, Close, LogOut)
+
+_current_lane: ContextVar[Lane] = ContextVar("outbound_lane", default=Lane.INTERACTIVE)
+
+
+@contextmanager
+def outbound_lane(lane: Lane):
+    """Send every Telegram request made inside the block through the given lane"""
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def in_lane(lane: Lane):
+    """Decorator version of :func:`outbound_lane` for coroutine functions"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with outbound_lane(lane):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Weighted fair scheduler for outbound Telegram requests.
+
+    Every request waits in the queue of its lane. A single dispatcher hands
+    out send slots at ``rate`` per second (with ``burst`` headroom) and picks
+    the next lane by smooth weighted round robin over non-empty queues, so a
+    lane gets its weighted share under load and the whole budget when alone.
+    """
+
+    def __init__(self, rate: float, burst: int, weights: Dict[Lane, int]):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.weights = {lane: max(weights.get(lane, 1), 1) for lane in Lane}
+        self.queues: Dict[Lane, Deque[asyncio.Future]] = {lane: deque() for lane in Lane}
+        self._current_weights = {lane: 0 for lane in Lane}
+        self._tokens = float(self.burst)
+        self._updated_at: Optional[float] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_settings(cls) -> "OutboundScheduler":
+        return cls(
+            rate=settings.OUTBOUND_RATE,
+            burst=settings.OUTBOUND_BURST,
+            weights={
+                Lane.INTERACTIVE: settings.OUTBOUND_WEIGHT_INTERACTIVE,
+                Lane.AUTH_STATE: settings.OUTBOUND_WEIGHT_AUTH_STATE,
+                Lane.QR_ROTATION: settings.OUTBOUND_WEIGHT_QR_ROTATION,
+                Lane.BULK: settings.OUTBOUND_WEIGHT_BULK,
+            }
+        )
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, UNSCHEDULED_METHODS):
+            return await make_request(bot, method)
+
+        lane = _current_lane.get()
+        with span(f"telegram {method.__api_method__}", **{"telegram.lane": lane.name}) as current:
+            loop = asyncio.get_running_loop()
+            queued_at = loop.time()
+            await self.acquire(lane)
+            if current is not None:
+                current.set_attribute("telegram.wait_ms", round((loop.time() - queued_at) * 1000, 1))
+            return await make_request(bot, method)
+
+    async def acquire(self, lane: Lane):
+        """Wait until the lane is granted a send slot"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self.queues[lane].append(future)
+        self._wakeup.set()
+        await future
+
+    def pending(self) -> Dict[Lane, int]:
+        """Number of requests waiting in every lane"""
+        return {lane: len(queue) for lane, queue in self.queues.items()}
+
+    async def close(self):
+        """Stop the dispatcher and fail requests still waiting for a slot"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for queue in self.queues.values():
+            while queue:
+                future = queue.popleft()
+                if not future.done():
+                    future.set_exception(RuntimeError("Outbound scheduler closed"))
+
+    def _pick_lane(self) -> Optional[Lane]:
+        active = [lane for lane, queue in self.queues.items() if queue]
+        for lane in Lane:
+            if lane not in active:
+                self._current_weights[lane] = 0
+        if not active:
+            return None
+        total = 0
+        for lane in active:
+            self._current_weights[lane] += self.weights[lane]
+            total += self.weights[lane]
+        lane = max(active, key=lambda item: (self._current_weights[item], -item))
+        self._current_weights[lane] -= total
+        return lane
+
+    async def _take_token(self):
+        if self.rate <= 0:
+            # Без лимита слоты раздаются сразу, порядок полос по весам сохраняется
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if self._updated_at is not None:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            await self._take_token()
+
+            granted = False
+            while not granted:
+                lane = self._pick_lane()
+                if lane is None:
+                    break
+                future = self.queues[lane].popleft()
+                if not future.done():
+                    future.set_result(None)
+                    granted = True
+
+            if not granted:
+                # Слот не понадобился - возвращаем токен
+                self._tokens = min(self.burst, self._tokens + 1)
+            if not any(self.queues.values()):
+                self._wakeup.clear()
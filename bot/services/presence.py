@@ -0,0 +1,197 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import select, update, bindparam
+
+from core.config import settings
+from core.events import event_bus, BotSilent, BotResumed
+from core.logger import logger
+from db.models import Bot
+from db.session import async_session
+
+
+@dataclass
+class BotPresence:
+    last_seen: float  # unix time of the last heartbeat or report
+    authed: Optional[bool] = None  # auth state last reported by the bot
+    qr_at: Optional[float] = None  # unix time of the last QR rotation
+    silent: bool = False
+    heartbeats: bool = False  # the bot sends /heartbeat, so its silence is tracked
+
+
+def _to_timestamp(value: Optional[datetime]) -> Optional[float]:
+    # last_seen хранится в UTC без часового пояса, как и created_at
+    return (value - datetime(1970, 1, 1)).total_seconds() if value else None
+
+
+def format_age(seconds: float) -> str:
+    seconds = int(max(seconds, 0))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m"
+    if seconds < 86400:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    return f"{seconds // 86400}d"
+
+
+class PresenceTable:
+    """In-memory liveness of WhatsApp bots.
+
+    Every heartbeat, QR rotation and auth report refreshes the bot's entry.
+    Silence is only tracked for bots that have sent a heartbeat since
+    start, since older clients report nothing once authenticated. A
+    background loop marks them silent after ``BOT_HEARTBEAT_TIMEOUT``
+    seconds without a report, publishes ``BotSilent``/``BotResumed`` on
+    transitions and writes changed ``last_seen`` values in one batch every
+    ``BOT_PRESENCE_INTERVAL``. Processes without heartbeats (a separate
+    worker) read the persisted ``bots.last_seen`` instead.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, BotPresence] = {}
+        self._dirty: Set[str] = set()
+        self._stopped = asyncio.Event()
+
+    def tracks(self, bot_id: str) -> bool:
+        return bot_id in self._entries
+
+    def seen(self, bot_id: str, authed: Optional[bool] = None, qr_rotated: bool = False,
+             heartbeat: bool = False) -> bool:
+        """Record a sign of life, return True if the bot was silent until now"""
+        now = time.time()
+        entry = self._entries.get(bot_id)
+        if entry is None:
+            entry = self._entries[bot_id] = BotPresence(last_seen=now)
+        entry.last_seen = now
+        if authed is not None:
+            entry.authed = authed
+        if qr_rotated:
+            entry.qr_at = now
+        if heartbeat:
+            entry.heartbeats = True
+        self._dirty.add(bot_id)
+
+        # О возвращении сообщаем только ботам, за тишиной которых следим
+        resumed = entry.silent and entry.heartbeats
+        entry.silent = False
+        return resumed
+
+    def status(self, bot: Bot) -> str:
+        """Live status lines of a loaded bot, without touching the database"""
+        now = time.time()
+        entry = self._entries.get(bot.id)
+        last_seen = entry.last_seen if entry else _to_timestamp(bot.last_seen)
+        if last_seen is None:
+            return "⚪ <b>Presence:</b> No heartbeat yet"
+
+        age = now - last_seen
+        timeout = settings.BOT_HEARTBEAT_TIMEOUT
+        # Без записи в таблице (отдельный воркер) судим по сохраненному last_seen
+        silent = entry.silent if entry else timeout > 0 and age > timeout
+        if silent:
+            text = f"🔴 <b>Presence:</b> Silent for {format_age(age)}"
+        else:
+            text = f"🟢 <b>Presence:</b> Online, seen {format_age(age)} ago"
+        authed = entry.authed if entry and entry.authed is not None else bot.authed
+        if entry and entry.qr_at and not authed:
+            text += f"\n🕒 <b>QR age:</b> {format_age(now - entry.qr_at)}"
+        return text
+
+    async def load(self):
+        """Seed the table from persisted last_seen values, already silent bots stay quiet"""
+        async with async_session() as db:
+            result = await db.execute(
+                select(Bot.id, Bot.last_seen, Bot.authed).where(Bot.last_seen.isnot(None))
+            )
+            rows = result.all()
+        timeout = settings.BOT_HEARTBEAT_TIMEOUT
+        now = time.time()
+        for bot_id, last_seen, authed in rows:
+            if bot_id in self._entries:
+                continue
+            last_seen = _to_timestamp(last_seen)
+            self._entries[bot_id] = BotPresence(
+                last_seen=last_seen,
+                authed=authed,
+                silent=timeout > 0 and now - last_seen > timeout
+            )
+        logger.info(f"Loaded presence of {len(rows)} bots")
+
+    async def check(self) -> List[str]:
+        """Mark bots over the heartbeat timeout as silent and publish BotSilent for each"""
+        timeout = settings.BOT_HEARTBEAT_TIMEOUT
+        if timeout <= 0:
+            return []
+        deadline = time.time() - timeout
+        silenced = []
+        for bot_id, entry in self._entries.items():
+            if entry.heartbeats and not entry.silent and entry.last_seen < deadline:
+                entry.silent = True
+                silenced.append(bot_id)
+        for bot_id in silenced:
+            logger.warning(f"Bot {bot_id} went silent")
+            await event_bus.publish(BotSilent(bot_id=bot_id, last_seen=self._entries[bot_id].last_seen))
+        return silenced
+
+    async def flush(self) -> int:
+        """Write changed last_seen values in one transaction, return the number of rows"""
+        if not self._dirty:
+            return 0
+        batch, self._dirty = self._dirty, set()
+        params = [
+            {"b_id": bot_id, "b_last_seen": datetime.fromtimestamp(self._entries[bot_id].last_seen, timezone.utc).replace(tzinfo=None)}
+            for bot_id in batch if bot_id in self._entries
+        ]
+        try:
+            async with async_session() as db:
+                await db.execute(
+                    update(Bot.__table__)
+                    .where(Bot.__table__.c.id == bindparam("b_id"))
+                    .values(last_seen=bindparam("b_last_seen")),
+                    params
+                )
+                await db.commit()
+        except Exception as e:
+            self._dirty |= batch
+            logger.error(f"Failed to persist presence of {len(batch)} bots: {e}")
+            return 0
+        return len(params)
+
+    async def start(self):
+        """Check for silent bots and persist presence until stopped"""
+        self._stopped.clear()
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error(f"Failed to load bot presence: {e}")
+        logger.info("Starting bot presence tracker...")
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=settings.BOT_PRESENCE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            if not self._stopped.is_set():
+                try:
+                    await self.check()
+                except Exception as e:
+                    logger.error(f"Bot silence check failed: {e}")
+            await self.flush()
+
+    def stop(self):
+        self._stopped.set()
+
+
+async def report_seen(bot_id: str, authed: Optional[bool] = None, qr_rotated: bool = False,
+                      heartbeat: bool = False):
+    """Record a sign of life of the bot and announce it if it was silent"""
+    if presence.seen(bot_id, authed, qr_rotated, heartbeat):
+        logger.info(f"Bot {bot_id} is back online")
+        await event_bus.publish(BotResumed(bot_id=bot_id))
+
+
+# Create global presence table instance
+presence = PresenceTable()
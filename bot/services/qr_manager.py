@@ -1,44 +1,45 @@
+import asyncio
 from typing import Optional
-import redis.asyncio as redis
 from sqlalchemy.ext.asyncio import AsyncSession
-from aiogram.types import FSInputFile, InputMediaPhoto
-import qrcode
-import tempfile
-import os
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InputMediaPhoto
 
 from db.repository import BotRepository, UserRepository
-from core.config import settings
+from bot.services.bot_connector import bot_connector
+from bot.services.outbound import Lane, in_lane
+from bot.services.qr_renderer import qr_renderer
+from bot.services.state_store import state_store, AUTH_NOTIFICATIONS, DEAUTH_NOTIFICATIONS
 from core.logger import logger
+from core.tracing import traced
 
-# Initialize Redis client if URL is provided
-redis_client: Optional[redis.Redis] = None
-if settings.REDIS_URL:
-    redis_client = redis.from_url(settings.REDIS_URL)
+MEDIA_GROUP_SIZE = 10  # Telegram limit of photos per sendMediaGroup
 
 
 class QRManager:
     @staticmethod
     async def get_last_qr_message(user_id: int, bot_id: str) -> Optional[int]:
-        """Get the last QR message ID from cache"""
-        if not redis_client:
-            return None
-
-        key = f"last_qr_msg:{user_id}:{bot_id}"
-        msg_id = await redis_client.get(key)
-        return int(msg_id) if msg_id else None
+        """Get the last QR message ID from the state store"""
+        messages = await state_store.get_qr_messages(bot_id, [user_id])
+        return messages.get(user_id)
 
     @staticmethod
     async def set_last_qr_message(user_id: int, bot_id: str, message_id: int):
-        """Cache the last QR message ID"""
-        if not redis_client:
-            return
+        """Store the last QR message ID"""
+        await state_store.set_qr_messages(bot_id, {user_id: message_id})
 
-        key = f"last_qr_msg:{user_id}:{bot_id}"
-        await redis_client.set(key, message_id, ex=86400)  # 24 hours TTL
+    @staticmethod
+    async def delete_last_qr_message(user_id: int, bot_id: str):
+        """Drop the stored QR message ID"""
+        await state_store.delete_qr_messages(bot_id, [user_id])
 
     @staticmethod
-    async def notify_subscribed_users(bot_id: str, db: AsyncSession, tg_bot):
-        """Notify all users subscribed to the bot about QR update (text notification if not authed)"""
+    @traced("qr.notify_subscribed_users")
+    @in_lane(Lane.QR_ROTATION)
+    async def notify_subscribed_users(bot_id: str, db: AsyncSession, qr_data: Optional[str] = None):
+        """Notify all users subscribed to the bot about QR update (text notification if not authed).
+
+        ``qr_data`` overrides the stored QR, for callers that already know the new one.
+        """
         bot_repo = BotRepository(db)
         user_repo = UserRepository(db)
         bot = await bot_repo.get_bot(bot_id)
@@ -47,73 +48,159 @@ class QRManager:
             return
 
         users = await user_repo.get_users_linked_to_bot(bot_id)
-        for user in users:
-            data = user.data or {}
-            auth_notifications_sent = data.get("auth_notifications_sent", {})
+        user_ids = [user.tg_id for user in users]
+        if not user_ids:
+            return
+        auth_notifications_sent = await state_store.get_flags(AUTH_NOTIFICATIONS, bot_id, user_ids)
+
+        if bot.authed:
+            # Бот авторизован, убедимся, что флаги сброшены
+            sent = [user_id for user_id, flag in auth_notifications_sent.items() if flag]
+            if sent:
+                await state_store.set_flags(AUTH_NOTIFICATIONS, bot_id, {user_id: False for user_id in sent})
+                logger.info(f"Reset auth required notification flag for users {sent}, bot {bot_id}.")
+            return
+
+        current_qr = qr_data or bot.current_qr
+        qr_messages = await state_store.get_qr_messages(bot_id, user_ids)
+        new_flags = {}
+        dead_messages = []
+        edited_messages = {}
+
+        async def notify_group(tg_bot, group_ids):
+            # Создаем QR код из данных (строки) один раз для всех пользователей этого бота
+            qr_photo = None
+            if current_qr and any(user_id in qr_messages for user_id in group_ids):
+                qr_photo = await qr_renderer.telegram_photo(current_qr, tg_bot)
 
-            if not bot.authed:
+            for user_id in group_ids:
                 # Бот не авторизован, отправляем текстовое уведомление, если еще не отправляли
-                if not auth_notifications_sent.get(bot_id, False):
-                    await tg_bot.send_message(
-                        chat_id=user.tg_id,
-                        text=f"⚠️ Bot {bot.name} requires authentication! Please use the 'Auth QR' button if you need to scan the QR code."
+                if not auth_notifications_sent.get(user_id, False):
+                    try:
+                        await tg_bot.send_message(
+                            chat_id=user_id,
+                            text=f"⚠️ Bot {bot.name} requires authentication! Please use the 'Auth QR' button if you need to scan the QR code."
+                        )
+                        new_flags[user_id] = True
+                        logger.info(f"Sent auth required notification to user {user_id} for bot {bot_id}.")
+                    except Exception as e:
+                        logger.error(f"Failed to send auth required notification to user {user_id}: {e}")
+
+                # Обновляем qr код на сообщении с id
+                qr_code_message = qr_messages.get(user_id)
+                if not qr_code_message or not qr_photo:
+                    continue
+                try:
+                    edited = await tg_bot.edit_message_media(
+                        chat_id=user_id,
+                        message_id=qr_code_message,
+                        media=InputMediaPhoto(media=qr_photo,
+                                              caption=f"🔐 QR Code for {bot.name}\n\nScan this QR code with WhatsApp to authenticate your bot.")
                     )
-                    auth_notifications_sent[bot_id] = True
-                    data["auth_notifications_sent"] = auth_notifications_sent
-                    user.data = data
-                    await user_repo.update_user_data(user.tg_id, data)
-                    logger.info(f"Sent auth required notification to user {user.tg_id} for bot {bot_id}.")
-                qr_code_message = data.get("qr_messages", {}).get(bot_id, None)
-
-                qr = qrcode.QRCode(
-                    version=1,
-                    error_correction=qrcode.constants.ERROR_CORRECT_L,
-                    box_size=10,
-                    border=4,
+                    edited_messages[user_id] = qr_code_message
+                    if not isinstance(qr_photo, str) and getattr(edited, "photo", None):
+                        # Первая загрузка дала file_id - остальным пользователям отправляем его
+                        qr_photo = edited.photo[-1].file_id
+                        qr_renderer.remember_file_id(current_qr, tg_bot, qr_photo)
+                except TelegramBadRequest as edit_e:
+                    # Сообщение удалено или устарело - забываем его ID
+                    logger.warning(
+                        f"Dropping dead QR message {qr_code_message} for user {user_id}, bot {bot_id}: {edit_e}")
+                    dead_messages.append(user_id)
+                except Exception as e:
+                    logger.error(f"Failed to update QR message for user {user_id}, bot {bot_id}: {e}")
+
+        try:
+            await bot_connector.fan_out(user_ids, notify_group)
+        finally:
+            await state_store.set_flags(AUTH_NOTIFICATIONS, bot_id, new_flags)
+            await state_store.delete_qr_messages(bot_id, dead_messages)
+            # Исправленное сообщение снова свежее, сборщик не должен удалить его по возрасту
+            await state_store.set_qr_messages(bot_id, edited_messages)
+
+    @staticmethod
+    @traced("qr.send_qr_albums")
+    async def send_qr_albums(user_id: int, db: AsyncSession, tg_bot) -> int:
+        """Send QR codes of every unauthenticated bot linked to the user as albums.
+
+        Renders go through the render cache concurrently and are sent with
+        ``sendMediaGroup``, ``MEDIA_GROUP_SIZE`` per call. Each bot's album
+        message is stored as its QR message, so rotations edit it in place.
+        Returns the number of QR codes sent.
+        """
+        bots = [bot for bot in await BotRepository(db).get_pending_auth_bots(user_id) if bot.current_qr]
+        if not bots:
+            return 0
+
+        # Прежние QR всех ботов пользователя одним запросом к хранилищу
+        previous = await state_store.get_user_qr_messages(user_id, [bot.id for bot in bots])
+        photos = await asyncio.gather(*(qr_renderer.telegram_photo(bot.current_qr, tg_bot) for bot in bots))
+
+        sent = 0
+        for start in range(0, len(bots), MEDIA_GROUP_SIZE):
+            chunk = list(zip(bots[start:start + MEDIA_GROUP_SIZE], photos[start:start + MEDIA_GROUP_SIZE]))
+            try:
+                messages = await tg_bot.send_media_group(
+                    chat_id=user_id,
+                    media=[
+                        InputMediaPhoto(media=photo, caption=f"🔐 QR Code for {bot.name}")
+                        for bot, photo in chunk
+                    ]
                 )
-                qr.add_data(bot.current_qr)  # <-- Здесь передаем чистую строку из БД
-                qr.make(fit=True)
+            except Exception as e:
+                # Прежние сообщения остаются на месте и в хранилище, ротации продолжат их править
+                logger.error(f"Failed to send QR album to user {user_id}: {e}")
+                continue
+
+            for (bot, photo), message in zip(chunk, messages):
+                if not isinstance(photo, str) and message.photo:
+                    qr_renderer.remember_file_id(bot.current_qr, tg_bot, message.photo[-1].file_id)
+                await state_store.set_qr_messages(bot.id, {user_id: message.message_id})
+            sent += len(chunk)
 
-                # Создаем изображение QR кода
-                qr_image = qr.make_image(fill_color="black", back_color="white")
+            # Старые QR удаляем, только когда новые уже отправлены и записаны (до 10 ID, один deleteMessages)
+            stale = [previous[bot.id] for bot, _ in chunk if bot.id in previous]
+            if stale:
+                try:
+                    await tg_bot.delete_messages(chat_id=user_id, message_ids=stale)
+                except Exception as e:
+                    logger.warning(f"Failed to delete previous QR messages of user {user_id}: {e}")
 
-                # Сохраняем во временный файл
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-                    qr_image.save(temp_file.name)
-                    temp_file_path = temp_file.name
+        logger.info(f"Sent {sent} QR codes in albums to user {user_id}")
+        return sent
 
+    @staticmethod
+    async def _delete_qr_messages(bot_id: str, user_ids: list):
+        """Delete QR messages of the bot in all given chats and forget their IDs"""
+        qr_messages = await state_store.get_qr_messages(bot_id, user_ids)
+        deleted = []
+
+        async def delete_group(tg_bot, group_ids):
+            for user_id in group_ids:
+                msg_id = qr_messages.get(user_id)
+                logger.info(
+                    f"Attempting to delete QR message for user {user_id}, bot {bot_id}. Message ID found: {msg_id}")
+                if not msg_id:
+                    logger.info(
+                        f"No QR message ID found for user {user_id}, bot {bot_id}. Message not deleted.")
+                    continue
                 try:
-                    # Создаем FSInputFile из временного файла
-                    qr_file = FSInputFile(temp_file_path)
-
-                    # Обновляем qr код на сообщении с id
-
-                    print("Trying to edit message: ", qr_code_message, "in chat: ", user.tg_id,data)
-                    if qr_code_message:
-                        await tg_bot.edit_message_media(
-                            chat_id=user.tg_id,
-                            message_id=qr_code_message,
-                            media=InputMediaPhoto(media=qr_file,
-                                                  caption=f"🔐 QR Code for {bot.name}\n\nScan this QR code with WhatsApp to authenticate your bot.")
-                        )
+                    # Удаляем сообщение с QR-кодом
+                    await tg_bot.delete_message(chat_id=user_id, message_id=msg_id)
+                    logger.info(f"Successfully deleted QR message {msg_id} for user {user_id}, bot {bot_id}.")
+                    deleted.append(user_id)
+                except Exception as delete_e:
+                    logger.error(
+                        f"Error deleting QR message {msg_id} for user {user_id}, bot {bot_id}: {delete_e}")
 
-                finally:
-                    # Удаляем временный файл
-                    try:
-                        os.unlink(temp_file_path)
-                    except Exception as e:
-                        logger.error(f"Error deleting temporary file: {e}")
-            else:
-                # Бот авторизован, убедимся, что флаг сброшен
-                if auth_notifications_sent.get(bot_id, False):
-                    auth_notifications_sent[bot_id] = False
-                    data["auth_notifications_sent"] = auth_notifications_sent
-                    user.data = data
-                    await user_repo.update_user_data(user.tg_id, data)
-                    logger.info(f"Reset auth required notification flag for user {user.tg_id}, bot {bot_id}.")
+        await bot_connector.fan_out(user_ids, delete_group)
+        # Удаляем message_id из хранилища
+        await state_store.delete_qr_messages(bot_id, deleted)
 
     @staticmethod
-    async def notify_auth_success(bot_id: str, db: AsyncSession, tg_bot):
+    @traced("qr.notify_auth_success")
+    @in_lane(Lane.AUTH_STATE)
+    async def notify_auth_success(bot_id: str, db: AsyncSession):
         """Notify users that the bot has been successfully authenticated"""
         bot_repo = BotRepository(db)
         user_repo = UserRepository(db)
@@ -122,53 +209,31 @@ class QRManager:
             logger.error(f"Bot {bot_id} not found")
             return
         users = await user_repo.get_users_linked_to_bot(bot_id)
-        for user in users:
-            try:
-                data = user.data or {}
-                qr_messages = data.get("qr_messages", {})
-                msg_id = qr_messages.get(bot_id)
-                logger.info(
-                    f"Attempting to delete QR message for user {user.tg_id}, bot {bot_id}. Message ID found: {msg_id}")
+        user_ids = [user.tg_id for user in users]
+        await QRManager._delete_qr_messages(bot_id, user_ids)
 
-                if msg_id:
-                    try:
-                        # Удаляем сообщение с QR-кодом
-                        await tg_bot.delete_message(chat_id=user.tg_id, message_id=msg_id)
-                        logger.info(f"Successfully deleted QR message {msg_id} for user {user.tg_id}, bot {bot_id}.")
-                        # Удаляем message_id из данных пользователя
-                        qr_messages.pop(bot_id, None)
-                        data["qr_messages"] = qr_messages
-                        user.data = data
-                        await user_repo.update_user_data(user.tg_id, data)
-                    except Exception as delete_e:
-                        logger.error(
-                            f"Error deleting QR message {msg_id} for user {user.tg_id}, bot {bot_id}: {delete_e}")
-                else:
-                    logger.info(
-                        f"No QR message ID found in user data for user {user.tg_id}, bot {bot_id}. Message not deleted.")
+        async def notify_group(tg_bot, group_ids):
+            for user_id in group_ids:
+                try:
+                    # Отправляем уведомление об успешной авторизации
+                    await tg_bot.send_message(
+                        chat_id=user_id,
+                        text=f"✅ Bot {bot.name} has been successfully authenticated!"
+                    )
+                    logger.info(f"Notified user {user_id} about successful authentication for bot {bot_id}")
+                except Exception as e:
+                    logger.error(f"Failed to notify user {user_id} about authentication success: {e}")
 
-                # Отправляем уведомление об успешной авторизации
-                await tg_bot.send_message(
-                    chat_id=user.tg_id,
-                    text=f"✅ Bot {bot.name} has been successfully authenticated!"
-                )
-                logger.info(f"Notified user {user.tg_id} about successful authentication for bot {bot_id}")
-
-                # Сбрасываем флаг уведомления о необходимости авторизации
-                auth_notifications_sent = data.get("auth_notifications_sent", {})
-                if auth_notifications_sent.get(bot_id, False):
-                    auth_notifications_sent[bot_id] = False
-                    data["auth_notifications_sent"] = auth_notifications_sent
-                    user.data = data
-                    await user_repo.update_user_data(user.tg_id, data)
-                    logger.info(
-                        f"Reset auth required notification flag for user {user.tg_id}, bot {bot_id} after successful auth.")
+        await bot_connector.fan_out(user_ids, notify_group)
 
-            except Exception as e:
-                logger.error(f"Failed to notify user {user.tg_id} about authentication success: {e}")
+        # Сбрасываем флаг уведомления о необходимости авторизации
+        await state_store.clear_flags(AUTH_NOTIFICATIONS, bot_id, user_ids)
+        logger.info(f"Reset auth required notification flags for bot {bot_id} after successful auth.")
 
     @staticmethod
-    async def notify_deauth_success(bot_id: str, db: AsyncSession, tg_bot):
+    @traced("qr.notify_deauth_success")
+    @in_lane(Lane.AUTH_STATE)
+    async def notify_deauth_success(bot_id: str, db: AsyncSession):
         bot_repo = BotRepository(db)
         user_repo = UserRepository(db)
         bot = await bot_repo.get_bot(bot_id)
@@ -176,47 +241,62 @@ class QRManager:
             logger.error(f"Bot {bot_id} not found")
             return
         users = await user_repo.get_users_linked_to_bot(bot_id)
-        for user in users:
-            try:
-                data = user.data or {}
-                qr_messages = data.get("qr_messages", {})
-                msg_id = qr_messages.get(bot_id)
-                logger.info(
-                    f"Attempting to delete QR message for user {user.tg_id}, bot {bot_id}. Message ID found: {msg_id}")
+        user_ids = [user.tg_id for user in users]
+        await QRManager._delete_qr_messages(bot_id, user_ids)
 
-                if msg_id:
-                    try:
-                        # Удаляем сообщение с QR-кодом
-                        await tg_bot.delete_message(chat_id=user.tg_id, message_id=msg_id)
-                        logger.info(f"Successfully deleted QR message {msg_id} for user {user.tg_id}, bot {bot_id}.")
-                        # Удаляем message_id из данных пользователя
-                        qr_messages.pop(bot_id, None)
-                        data["qr_messages"] = qr_messages
-                        user.data = data
-                        await user_repo.update_user_data(user.tg_id, data)
-                    except Exception as delete_e:
-                        logger.error(
-                            f"Error deleting QR message {msg_id} for user {user.tg_id}, bot {bot_id}: {delete_e}")
-                else:
-                    logger.info(
-                        f"No QR message ID found in user data for user {user.tg_id}, bot {bot_id}. Message not deleted.")
+        async def notify_group(tg_bot, group_ids):
+            for user_id in group_ids:
+                try:
+                    # Отправляем уведомление об успешной деавторизации
+                    await tg_bot.send_message(
+                        chat_id=user_id,
+                        text=f"🔴 Bot {bot.name} has been successfully deauthenticated!"
+                    )
+                    logger.info(f"Notified user {user_id} about successful deauthentication for bot {bot_id}")
+                except Exception as e:
+                    logger.error(f"Failed to notify user {user_id} about deauthentication success: {e}")
 
-                # Отправляем уведомление об успешной авторизации
-                await tg_bot.send_message(
-                    chat_id=user.tg_id,
-                    text=f"🔴 Bot {bot.name} has been successfully deauthenticated!"
-                )
-                logger.info(f"Notified user {user.tg_id} about successful deauthentication for bot {bot_id}")
-
-                # Сбрасываем флаг уведомления о необходимости авторизации
-                auth_notifications_sent = data.get("deauth_notifications_sent", {})
-                if auth_notifications_sent.get(bot_id, False):
-                    auth_notifications_sent[bot_id] = False
-                    data["deauth_notifications_sent"] = auth_notifications_sent
-                    user.data = data
-                    await user_repo.update_user_data(user.tg_id, data)
-                    logger.info(
-                        f"Reset auth required notification flag for user {user.tg_id}, bot {bot_id} after successful deauth.")
+        await bot_connector.fan_out(user_ids, notify_group)
 
-            except Exception as e:
-                logger.error(f"Failed to notify user {user.tg_id} about deauthentication success: {e}")
+        await state_store.clear_flags(DEAUTH_NOTIFICATIONS, bot_id, user_ids)
+        logger.info(f"Reset deauth notification flags for bot {bot_id} after successful deauth.")
+
+    @staticmethod
+    async def _notify_linked_users(bot_id: str, db: AsyncSession, text: str):
+        """Send the same text to every user linked to the bot"""
+        users = await UserRepository(db).get_users_linked_to_bot(bot_id)
+
+        async def notify_group(tg_bot, group_ids):
+            for user_id in group_ids:
+                try:
+                    await tg_bot.send_message(chat_id=user_id, text=text)
+                    logger.info(f"Notified user {user_id} about presence of bot {bot_id}")
+                except Exception as e:
+                    logger.error(f"Failed to notify user {user_id} about presence of bot {bot_id}: {e}")
+
+        await bot_connector.fan_out([user.tg_id for user in users], notify_group)
+
+    @staticmethod
+    @traced("qr.notify_bot_silent")
+    @in_lane(Lane.AUTH_STATE)
+    async def notify_bot_silent(bot_id: str, db: AsyncSession, silent_for: float):
+        """Tell linked users that the bot stopped sending heartbeats"""
+        bot = await BotRepository(db).get_bot(bot_id)
+        if not bot:
+            logger.error(f"Bot {bot_id} not found")
+            return
+        await QRManager._notify_linked_users(
+            bot_id, db,
+            f"🔴 Bot {bot.name} has not reported for {int(silent_for // 60)} min. Its WhatsApp process may be down."
+        )
+
+    @staticmethod
+    @traced("qr.notify_bot_resumed")
+    @in_lane(Lane.AUTH_STATE)
+    async def notify_bot_resumed(bot_id: str, db: AsyncSession):
+        """Tell linked users that a silent bot reports again"""
+        bot = await BotRepository(db).get_bot(bot_id)
+        if not bot:
+            logger.error(f"Bot {bot_id} not found")
+            return
+        await QRManager._notify_linked_users(bot_id, db, f"🟢 Bot {bot.name} is back online.")
@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from aiogram.types import BufferedInputFile
+
+from bot.services.outbound import Lane, outbound_lane
+from core.config import settings
+from core.logger import logger
+from core.tracing import span
+
+
+# Supported output formats and their content types
+FORMATS = {
+    "png": "image/png",  # RGB PNG drawn by PIL
+    "png1": "image/png",  # 1-bit grayscale PNG packed straight from the module matrix
+    "svg": "image/svg+xml",  # vector path, scales to any size
+}
+
+BOX_SIZE = 10
+BORDER = 4
+
+
+def build_matrix(payload: str) -> List[List[bool]]:
+    """QR module matrix of the payload, border included"""
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=BOX_SIZE,
+        border=BORDER,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def encode_png(payload: str) -> bytes:
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=BOX_SIZE,
+        border=BORDER,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    buffer = BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def encode_png1(payload: str, box_size: int = BOX_SIZE) -> bytes:
+    """1-bit grayscale PNG written without PIL, same pixel size as ``encode_png``"""
+    matrix = build_matrix(payload)
+    size = len(matrix) * box_size
+    row_bytes = (size + 7) // 8
+    scanlines = []
+    for row in matrix:
+        # 0 - черный модуль, 1 - белый фон
+        bits = "".join(("0" if dark else "1") * box_size for dark in row)
+        bits = bits.ljust(row_bytes * 8, "1")
+        scanline = b"\x00" + int(bits, 2).to_bytes(row_bytes, "big")
+        scanlines.extend([scanline] * box_size)
+
+    header = struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(b"".join(scanlines), 9))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def encode_svg(payload: str, box_size: int = BOX_SIZE) -> bytes:
+    """SVG with a single path, one unit per module"""
+    matrix = build_matrix(payload)
+    size = len(matrix)
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            # Соседние темные модули строки объединяем в один прямоугольник
+            start = x
+            while x < size and row[x]:
+                x += 1
+            path.append(f"M{start} {y}h{x - start}v1h{start - x}z")
+    pixels = size * box_size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(path)}"/></svg>'
+    ).encode("utf-8")
+
+
+ENCODERS: Dict[str, Callable[[str], bytes]] = {
+    "png": encode_png,
+    "png1": encode_png1,
+    "svg": encode_svg,
+}
+
+
+class QRRenderer:
+    """Renders QR payloads and keeps the most recent results.
+
+    ``qrcode`` and PIL are imported on the first render, so processes that
+    never draw a QR code do not pay for loading them. Output format is
+    picked per destination (``QR_TELEGRAM_FORMAT`` for Telegram). New
+    payloads can be warmed up in the background, optionally uploading them
+    once to ``QR_CACHE_CHAT_ID`` so later sends reuse the Telegram
+    ``file_id``.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._file_ids: "OrderedDict[Tuple[int, str], str]" = OrderedDict()
+        self._rendering: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._uploading: Set[Tuple[int, str]] = set()
+        self._current: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()  # bot_id -> (hash, seen_at)
+
+    @staticmethod
+    def payload_hash(payload: str) -> str:
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def set_current(self, bot_id: str, payload: Optional[str]):
+        """Remember the payload the bot shows now, None when it has no QR"""
+        self._current[bot_id] = (self.payload_hash(payload) if payload else None, time.monotonic())
+        self._current.move_to_end(bot_id)
+        while len(self._current) > self.max_entries:
+            self._current.popitem(last=False)
+
+    def current_hash(self, bot_id: str) -> Optional[str]:
+        """Hash of the bot's current payload, if it is known and fresh"""
+        entry = self._current.get(bot_id)
+        # Смену QR в другом процессе увидим не позже чем через QR_API_ETAG_TTL
+        if entry is None or time.monotonic() - entry[1] >= settings.QR_API_ETAG_TTL:
+            return None
+        return entry[0]
+
+    def get_cached(self, payload: str, fmt: str = "png") -> Optional[bytes]:
+        key = (fmt, self.payload_hash(payload))
+        image = self._cache.get(key)
+        if image is not None:
+            self._cache.move_to_end(key)
+        return image
+
+    def render(self, payload: str, fmt: str = "png") -> bytes:
+        """Render the payload in the given format, using the cache when possible"""
+        if fmt not in ENCODERS:
+            raise ValueError(f"Unknown QR format: {fmt}")
+        image = self.get_cached(payload, fmt)
+        if image is not None:
+            return image
+
+        image = ENCODERS[fmt](payload)
+        self._cache[(fmt, self.payload_hash(payload))] = image
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        logger.debug(f"Rendered QR code as {fmt} ({len(image)} bytes)")
+        return image
+
+    async def render_async(self, payload: str, fmt: str = "png") -> bytes:
+        """Render off the event loop unless the result is already cached"""
+        image = self.get_cached(payload, fmt)
+        if image is not None:
+            return image
+
+        # Одновременные запросы одного и того же QR ждут один общий рендер
+        key = (fmt, self.payload_hash(payload))
+        task = self._rendering.get(key)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(self.render, payload, fmt))
+            self._rendering[key] = task
+            task.add_done_callback(lambda _: self._rendering.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def render_for_telegram(self, payload: str) -> bytes:
+        return await self.render_async(payload, settings.QR_TELEGRAM_FORMAT)
+
+    def get_file_id(self, payload: str, tg_bot) -> Optional[str]:
+        """Telegram file_id of an already uploaded render, valid for this bot only"""
+        return self._file_ids.get((tg_bot.id, self.payload_hash(payload)))
+
+    def remember_file_id(self, payload: str, tg_bot, file_id: str):
+        self._file_ids[(tg_bot.id, self.payload_hash(payload))] = file_id
+        while len(self._file_ids) > self.max_entries:
+            self._file_ids.popitem(last=False)
+
+    async def telegram_photo(self, payload: str, tg_bot) -> Union[str, BufferedInputFile]:
+        """A file_id when the render was uploaded before, PNG bytes otherwise"""
+        file_id = self.get_file_id(payload, tg_bot)
+        with span("qr.render", **{"qr.cached_file_id": bool(file_id)}):
+            if file_id:
+                return file_id
+            return BufferedInputFile(await self.render_for_telegram(payload), filename="qr.png")
+
+    async def warm(self, payload: str, tg_bot=None):
+        """Render the payload and, if a cache chat is configured, pre-upload it"""
+        try:
+            png = await self.render_for_telegram(payload)
+            if tg_bot is None or not settings.QR_CACHE_CHAT_ID or self.get_file_id(payload, tg_bot):
+                return
+            upload_key = (tg_bot.id, self.payload_hash(payload))
+            if upload_key in self._uploading:
+                return
+            self._uploading.add(upload_key)
+            try:
+                with outbound_lane(Lane.QR_ROTATION):
+                    message = await tg_bot.send_photo(
+                        chat_id=settings.QR_CACHE_CHAT_ID,
+                        photo=BufferedInputFile(png, filename="qr.png"),
+                        disable_notification=True
+                    )
+            finally:
+                self._uploading.discard(upload_key)
+            self.remember_file_id(payload, tg_bot, message.photo[-1].file_id)
+            logger.debug(f"Pre-uploaded QR code to cache chat {settings.QR_CACHE_CHAT_ID}")
+        except Exception as e:
+            logger.warning(f"QR warm-up failed: {e}")
+
+    def schedule_warm(self, payload: str, tg_bot=None):
+        """Warm the payload up in the background"""
+        if not payload or not settings.QR_WARMUP_ENABLED:
+            return
+        task = asyncio.create_task(self.warm(payload, tg_bot))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+
+# Create global renderer instance
+qr_renderer = QRRenderer(settings.QR_RENDER_CACHE_SIZE)
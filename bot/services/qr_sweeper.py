@@ -0,0 +1,122 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+
+from bot.services.bot_connector import bot_connector
+from bot.services.outbound import Lane, in_lane
+from bot.services.state_store import state_store
+from core.config import settings
+from core.logger import logger
+from db.repository import UserRepository
+from db.session import async_session
+
+
+class QRMessageSweeper:
+    """Periodically removes stale and orphaned QR message references.
+
+    An entry in the state store is collected when its bot no longer exists,
+    the user is no longer linked to it, the bot is already authenticated,
+    or the message has outlived ``QR_MESSAGE_TTL`` since it was last sent
+    or edited.
+    """
+
+    def __init__(self):
+        self._stopped = asyncio.Event()
+
+    async def start(self):
+        """Run sweeps until stopped"""
+        self._stopped.clear()
+        logger.info("Starting QR message sweeper...")
+        while not self._stopped.is_set():
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"QR message sweep failed: {e}")
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=settings.QR_GC_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        """Stop the sweeper after the current batch"""
+        self._stopped.set()
+
+    @in_lane(Lane.BULK)
+    async def sweep(self) -> int:
+        """Run a single sweep, return the number of collected entries"""
+        stale = await self._collect_stale()
+        if not stale:
+            logger.debug("QR message sweep: nothing to collect")
+            return 0
+
+        collected = 0
+        batch_size = max(settings.QR_GC_BATCH_SIZE, 1)
+        for start in range(0, len(stale), batch_size):
+            if self._stopped.is_set():
+                break
+            batch = stale[start:start + batch_size]
+            pruned: Dict[str, List[int]] = {}
+            for tg_id, bot_id, msg_id, reason in batch:
+                if await self._delete_message(tg_id, bot_id, msg_id, reason):
+                    pruned.setdefault(bot_id, []).append(tg_id)
+
+            for bot_id, user_ids in pruned.items():
+                await state_store.delete_qr_messages(bot_id, user_ids)
+                collected += len(user_ids)
+
+            if start + batch_size < len(stale):
+                await asyncio.sleep(settings.QR_GC_BATCH_DELAY)
+
+        logger.info(f"QR message sweep collected {collected} of {len(stale)} stale entries")
+        return collected
+
+    async def _collect_stale(self) -> List[Tuple[int, str, int, str]]:
+        """Find stale entries as (tg_id, bot_id, message_id, reason)"""
+        now = int(time.time())
+        entries = await state_store.iter_qr_messages()
+        if not entries:
+            return []
+
+        async with async_session() as db:
+            users = await UserRepository(db).get_users_with_links()
+        links = {user.tg_id: {bot.id: bot for bot in user.bots} for user in users}
+
+        stale = []
+        unstamped: Dict[str, Dict[int, int]] = {}
+        for tg_id, bot_id, msg_id, sent_at in entries:
+            bot = links.get(tg_id, {}).get(bot_id)
+            if bot is None:
+                stale.append((tg_id, bot_id, msg_id, "orphaned"))
+            elif bot.authed:
+                stale.append((tg_id, bot_id, msg_id, "bot authed"))
+            elif sent_at is None:
+                unstamped.setdefault(bot_id, {})[tg_id] = msg_id
+            elif now - sent_at > settings.QR_MESSAGE_TTL:
+                stale.append((tg_id, bot_id, msg_id, "expired"))
+
+        # Записи без времени отправки - начинаем отсчет TTL с текущего момента
+        for bot_id, messages in unstamped.items():
+            await state_store.set_qr_messages(bot_id, messages)
+        return stale
+
+    @staticmethod
+    async def _delete_message(tg_id: int, bot_id: str, msg_id: Optional[int], reason: str) -> bool:
+        """Delete the Telegram message, return True if the reference can be dropped"""
+        if not msg_id:
+            return True
+        try:
+            await bot_connector.bot_for(tg_id).delete_message(chat_id=tg_id, message_id=msg_id)
+            logger.info(f"Deleted {reason} QR message {msg_id} for user {tg_id}, bot {bot_id}")
+        except TelegramBadRequest as e:
+            # Сообщение уже удалено или слишком старое для удаления
+            logger.info(f"QR message {msg_id} for user {tg_id}, bot {bot_id} is gone: {e}")
+        except Exception as e:
+            logger.warning(f"Failed to delete QR message {msg_id} for user {tg_id}, bot {bot_id}: {e}")
+            return False
+        return True
+
+
+# Create global sweeper instance
+qr_sweeper = QRMessageSweeper()
@@ -0,0 +1,311 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from core.logger import logger
+from core.redis import redis_client
+from db.repository import UserRepository
+from db.session import async_session
+
+# Per-bot notification flags kept for every linked user
+AUTH_NOTIFICATIONS = "auth_notifications_sent"
+DEAUTH_NOTIFICATIONS = "deauth_notifications_sent"
+
+# (tg_id, bot_id, message_id, sent_at)
+QRMessageEntry = Tuple[int, str, int, Optional[int]]
+
+
+class StateStore(ABC):
+    """Storage for QR message IDs and notification flags.
+
+    Every method works on all recipients of one bot at once, so a fan-out
+    costs a single round trip to the backend regardless of the user count.
+    """
+
+    @abstractmethod
+    async def get_qr_messages(self, bot_id: str, user_ids: List[int]) -> Dict[int, int]:
+        """Get QR message IDs of the bot for the given users"""
+
+    @abstractmethod
+    async def get_user_qr_messages(self, user_id: int, bot_ids: List[str]) -> Dict[str, int]:
+        """Get QR message IDs of one user for the given bots"""
+
+    @abstractmethod
+    async def set_qr_messages(self, bot_id: str, messages: Dict[int, int]):
+        """Store QR message IDs of the bot, keyed by user"""
+
+    @abstractmethod
+    async def delete_qr_messages(self, bot_id: str, user_ids: List[int]):
+        """Forget QR message IDs of the bot for the given users"""
+
+    @abstractmethod
+    async def iter_qr_messages(self) -> List[QRMessageEntry]:
+        """List every stored QR message reference"""
+
+    @abstractmethod
+    async def get_flags(self, kind: str, bot_id: str, user_ids: List[int]) -> Dict[int, bool]:
+        """Get notification flags of the bot for the given users"""
+
+    @abstractmethod
+    async def set_flags(self, kind: str, bot_id: str, flags: Dict[int, bool]):
+        """Store notification flags of the bot, keyed by user"""
+
+    @abstractmethod
+    async def clear_flags(self, kind: str, bot_id: str, user_ids: Optional[List[int]] = None,
+                          db: Optional[AsyncSession] = None):
+        """Drop notification flags of the bot, for all users if none are given.
+
+        The SQL store runs inside ``db``'s transaction when a session is given
+        and leaves the commit to the caller.
+        """
+
+
+class MemoryStateStore(StateStore):
+    """Process-local store, state is lost on restart"""
+
+    def __init__(self):
+        self._qr_messages: Dict[str, Dict[int, Tuple[int, int]]] = {}
+        self._flags: Dict[Tuple[str, str], Dict[int, bool]] = {}
+
+    async def get_qr_messages(self, bot_id: str, user_ids: List[int]) -> Dict[int, int]:
+        messages = self._qr_messages.get(bot_id, {})
+        return {user_id: messages[user_id][0] for user_id in user_ids if user_id in messages}
+
+    async def get_user_qr_messages(self, user_id: int, bot_ids: List[str]) -> Dict[str, int]:
+        return {
+            bot_id: self._qr_messages[bot_id][user_id][0]
+            for bot_id in bot_ids if user_id in self._qr_messages.get(bot_id, {})
+        }
+
+    async def set_qr_messages(self, bot_id: str, messages: Dict[int, int]):
+        now = int(time.time())
+        stored = self._qr_messages.setdefault(bot_id, {})
+        for user_id, message_id in messages.items():
+            stored[user_id] = (message_id, now)
+
+    async def delete_qr_messages(self, bot_id: str, user_ids: List[int]):
+        stored = self._qr_messages.get(bot_id, {})
+        for user_id in user_ids:
+            stored.pop(user_id, None)
+
+    async def iter_qr_messages(self) -> List[QRMessageEntry]:
+        return [
+            (user_id, bot_id, message_id, sent_at)
+            for bot_id, messages in self._qr_messages.items()
+            for user_id, (message_id, sent_at) in messages.items()
+        ]
+
+    async def get_flags(self, kind: str, bot_id: str, user_ids: List[int]) -> Dict[int, bool]:
+        flags = self._flags.get((kind, bot_id), {})
+        return {user_id: flags.get(user_id, False) for user_id in user_ids}
+
+    async def set_flags(self, kind: str, bot_id: str, flags: Dict[int, bool]):
+        self._flags.setdefault((kind, bot_id), {}).update(flags)
+
+    async def clear_flags(self, kind: str, bot_id: str, user_ids: Optional[List[int]] = None,
+                          db: Optional[AsyncSession] = None):
+        if user_ids is None:
+            self._flags.pop((kind, bot_id), None)
+            return
+        flags = self._flags.get((kind, bot_id), {})
+        for user_id in user_ids:
+            flags.pop(user_id, None)
+
+
+class RedisStateStore(StateStore):
+    """Shared store backed by Redis.
+
+    QR message IDs live in ``last_qr_msg:{user_id}:{bot_id}`` keys and are
+    indexed by send time in one sorted set, which the sweeper reads to find
+    expired messages; the keys have no TTL, so no message is forgotten
+    before the sweeper deletes it from the chat. Notification flags live in
+    one hash per bot.
+    """
+
+    # Индекс "{user_id}:{bot_id}" -> время отправки (или последней правки) сообщения
+    QR_INDEX_KEY = "last_qr_msg_sent_at"
+
+    def __init__(self, client):
+        self.redis = client
+
+    @staticmethod
+    def _qr_key(user_id: int, bot_id: str) -> str:
+        return f"last_qr_msg:{user_id}:{bot_id}"
+
+    @staticmethod
+    def _qr_member(user_id: int, bot_id: str) -> str:
+        return f"{user_id}:{bot_id}"
+
+    @staticmethod
+    def _flags_key(kind: str, bot_id: str) -> str:
+        return f"{kind}:{bot_id}"
+
+    async def get_qr_messages(self, bot_id: str, user_ids: List[int]) -> Dict[int, int]:
+        if not user_ids:
+            return {}
+        values = await self.redis.mget([self._qr_key(user_id, bot_id) for user_id in user_ids])
+        return {user_id: int(value) for user_id, value in zip(user_ids, values) if value}
+
+    async def get_user_qr_messages(self, user_id: int, bot_ids: List[str]) -> Dict[str, int]:
+        if not bot_ids:
+            return {}
+        values = await self.redis.mget([self._qr_key(user_id, bot_id) for bot_id in bot_ids])
+        return {bot_id: int(value) for bot_id, value in zip(bot_ids, values) if value}
+
+    async def set_qr_messages(self, bot_id: str, messages: Dict[int, int]):
+        if not messages:
+            return
+        now = int(time.time())
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for user_id, message_id in messages.items():
+                pipe.set(self._qr_key(user_id, bot_id), message_id)
+            pipe.zadd(self.QR_INDEX_KEY, {self._qr_member(user_id, bot_id): now for user_id in messages})
+            await pipe.execute()
+
+    async def delete_qr_messages(self, bot_id: str, user_ids: List[int]):
+        if not user_ids:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*[self._qr_key(user_id, bot_id) for user_id in user_ids])
+            pipe.zrem(self.QR_INDEX_KEY, *[self._qr_member(user_id, bot_id) for user_id in user_ids])
+            await pipe.execute()
+
+    async def iter_qr_messages(self) -> List[QRMessageEntry]:
+        indexed = await self.redis.zrange(self.QR_INDEX_KEY, 0, -1, withscores=True)
+        if not indexed:
+            return []
+        members = []
+        for member, sent_at in indexed:
+            user_id, bot_id = (member.decode() if isinstance(member, bytes) else member).split(":", 1)
+            members.append((int(user_id), bot_id, int(sent_at)))
+        values = await self.redis.mget([self._qr_key(user_id, bot_id) for user_id, bot_id, _ in members])
+
+        entries = []
+        missing = []
+        for (user_id, bot_id, sent_at), value in zip(members, values):
+            if value:
+                entries.append((user_id, bot_id, int(value), sent_at))
+            else:
+                missing.append(self._qr_member(user_id, bot_id))
+        if missing:
+            # Ключ удалили в обход хранилища - убираем и запись индекса
+            await self.redis.zrem(self.QR_INDEX_KEY, *missing)
+        return entries
+
+    async def get_flags(self, kind: str, bot_id: str, user_ids: List[int]) -> Dict[int, bool]:
+        if not user_ids:
+            return {}
+        values = await self.redis.hmget(self._flags_key(kind, bot_id), [str(user_id) for user_id in user_ids])
+        return {user_id: value == b"1" for user_id, value in zip(user_ids, values)}
+
+    async def set_flags(self, kind: str, bot_id: str, flags: Dict[int, bool]):
+        if not flags:
+            return
+        await self.redis.hset(
+            self._flags_key(kind, bot_id),
+            mapping={str(user_id): "1" if flag else "0" for user_id, flag in flags.items()}
+        )
+
+    async def clear_flags(self, kind: str, bot_id: str, user_ids: Optional[List[int]] = None,
+                          db: Optional[AsyncSession] = None):
+        if user_ids is None:
+            await self.redis.delete(self._flags_key(kind, bot_id))
+        elif user_ids:
+            await self.redis.hdel(self._flags_key(kind, bot_id), *[str(user_id) for user_id in user_ids])
+
+
+class SQLStateStore(StateStore):
+    """Store backed by the ``User.data`` JSON column.
+
+    Reads use a single ``IN`` query; writes are executemany JSON-path
+    ``UPDATE``s that touch only the keys of one bot, so writers of other
+    keys in the same ``User.data`` are not overwritten.
+    """
+
+    async def get_qr_messages(self, bot_id: str, user_ids: List[int]) -> Dict[int, int]:
+        async with async_session() as db:
+            users_data = await UserRepository(db).get_users_data(user_ids)
+        messages = {}
+        for user_id, data in users_data.items():
+            message_id = data.get("qr_messages", {}).get(bot_id)
+            if message_id:
+                messages[user_id] = message_id
+        return messages
+
+    async def get_user_qr_messages(self, user_id: int, bot_ids: List[str]) -> Dict[str, int]:
+        async with async_session() as db:
+            users_data = await UserRepository(db).get_users_data([user_id])
+        qr_messages = users_data.get(user_id, {}).get("qr_messages", {})
+        return {bot_id: qr_messages[bot_id] for bot_id in bot_ids if qr_messages.get(bot_id)}
+
+    async def set_qr_messages(self, bot_id: str, messages: Dict[int, int]):
+        now = int(time.time())
+        async with async_session() as db:
+            user_repo = UserRepository(db)
+            await user_repo.set_data_path(["qr_messages", bot_id], messages, commit=False)
+            await user_repo.set_data_path(["qr_message_times", bot_id], {user_id: now for user_id in messages}, commit=False)
+            await db.commit()
+
+    async def delete_qr_messages(self, bot_id: str, user_ids: List[int]):
+        if not user_ids:
+            return
+        async with async_session() as db:
+            user_repo = UserRepository(db)
+            await user_repo.clear_bot_flags("qr_messages", bot_id, user_ids, commit=False)
+            await user_repo.clear_bot_flags("qr_message_times", bot_id, user_ids, commit=False)
+            await db.commit()
+
+    async def iter_qr_messages(self) -> List[QRMessageEntry]:
+        async with async_session() as db:
+            users_data = await UserRepository(db).get_all_users_data()
+        entries = []
+        for user_id, data in users_data.items():
+            qr_message_times = data.get("qr_message_times", {})
+            for bot_id, message_id in data.get("qr_messages", {}).items():
+                entries.append((user_id, bot_id, message_id, qr_message_times.get(bot_id)))
+        return entries
+
+    async def get_flags(self, kind: str, bot_id: str, user_ids: List[int]) -> Dict[int, bool]:
+        async with async_session() as db:
+            users_data = await UserRepository(db).get_users_data(user_ids)
+        return {
+            user_id: bool(users_data.get(user_id, {}).get(kind, {}).get(bot_id, False))
+            for user_id in user_ids
+        }
+
+    async def set_flags(self, kind: str, bot_id: str, flags: Dict[int, bool]):
+        async with async_session() as db:
+            await UserRepository(db).set_data_path([kind, bot_id], flags)
+
+    async def clear_flags(self, kind: str, bot_id: str, user_ids: Optional[List[int]] = None,
+                          db: Optional[AsyncSession] = None):
+        # Один UPDATE с JSON-путем вместо чтения и записи каждого пользователя
+        if db is not None:
+            await UserRepository(db).clear_bot_flags(kind, bot_id, user_ids, commit=False)
+            return
+        async with async_session() as db:
+            await UserRepository(db).clear_bot_flags(kind, bot_id, user_ids)
+
+
+def create_state_store() -> StateStore:
+    """Create the state store selected by ``STATE_BACKEND``"""
+    backend = settings.STATE_BACKEND or ("redis" if redis_client else "sql")
+    if backend == "redis":
+        if not redis_client:
+            raise RuntimeError("STATE_BACKEND=redis requires REDIS_URL to be set")
+        store = RedisStateStore(redis_client)
+    elif backend == "memory":
+        store = MemoryStateStore()
+    elif backend == "sql":
+        store = SQLStateStore()
+    else:
+        raise ValueError(f"Unknown state backend: {backend}")
+    logger.info(f"Using {backend} state store")
+    return store
+
+
+# Create global state store instance
+state_store = create_state_store()
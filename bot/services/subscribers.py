@@ -0,0 +1,95 @@
+import time
+
+from bot.services.bot_connector import bot_connector
+from bot.services.digest import digest_buffer
+from bot.services.outbound import Lane, outbound_lane
+from bot.services.qr_manager import QRManager
+from bot.services.qr_renderer import qr_renderer
+from core.events import EventBus, BotRegistered, QrRotated, BotAuthed, BotDeauthed, BotSilent, BotResumed, CustomNotify
+from core.logger import logger
+from db.repository import BotRepository, UserRepository
+from db.session import async_session
+
+
+async def on_bot_registered(event: BotRegistered):
+    logger.info(f"WhatsApp bot registered: {event.bot_id} ({event.name})")
+
+
+async def warm_rotated_qr(event: QrRotated):
+    # Рендерим (и при необходимости загружаем) новый QR заранее, до нажатия "Auth QR"
+    for tg_bot in bot_connector.bots:
+        qr_renderer.schedule_warm(event.qr_data, tg_bot)
+
+
+async def notify_qr_rotated(event: QrRotated):
+    async with async_session() as db:
+        await QRManager.notify_subscribed_users(event.bot_id, db, qr_data=event.qr_data)
+
+
+async def notify_bot_authed(event: BotAuthed):
+    async with async_session() as db:
+        await QRManager.notify_auth_success(event.bot_id, db)
+
+
+async def notify_bot_deauthed(event: BotDeauthed):
+    async with async_session() as db:
+        await QRManager.notify_deauth_success(event.bot_id, db)
+
+
+async def notify_bot_silent(event: BotSilent):
+    async with async_session() as db:
+        await QRManager.notify_bot_silent(event.bot_id, db, time.time() - event.last_seen)
+
+
+async def notify_bot_resumed(event: BotResumed):
+    async with async_session() as db:
+        await QRManager.notify_bot_resumed(event.bot_id, db)
+
+
+async def deliver_custom_notification(event: CustomNotify):
+    async with async_session() as db:
+        users_to_notify = await UserRepository(db).get_users_linked_to_bot(event.bot_id)
+        bot_info = await BotRepository(db).get_bot(event.bot_id)
+
+    message_text = f"**📢 Custom Notification from {event.sender_name}**\n\n{event.message}"
+    if bot_info:
+        message_text = f"**📢 Custom Notification from Bot {bot_info.name} ({event.sender_name})**\n\n{event.message}"
+
+    users_by_id = {user.tg_id: user for user in users_to_notify}
+
+    async def deliver_group(tg_bot, group_ids):
+        for user in (users_by_id[tg_id] for tg_id in group_ids):
+            try:
+                window = digest_buffer.window_for(event.bot_id, user.data)
+                if bot_info and not event.urgent and window > 0:
+                    await digest_buffer.add(
+                        tg_bot, event.bot_id, bot_info.name, user.tg_id,
+                        event.sender_name, event.message, window
+                    )
+                    continue
+
+                await tg_bot.send_message(
+                    chat_id=user.tg_id,
+                    text=message_text,
+                    parse_mode="Markdown"
+                )
+                logger.info(f"Sent custom notification to user {user.tg_id} from {event.sender_name}")
+            except Exception as e:
+                logger.error(f"Failed to send custom notification to user {user.tg_id}: {e}")
+
+    # Рассылка идет в самую низкоприоритетную полосу, чтобы не задерживать интерактив;
+    # каждый токен пула рассылает своим пользователям параллельно
+    with outbound_lane(Lane.BULK):
+        await bot_connector.fan_out(list(users_by_id), deliver_group)
+
+
+def register_subscribers(bus: EventBus):
+    """Subscribe Telegram delivery handlers to the event bus"""
+    bus.subscribe(BotRegistered, on_bot_registered)
+    bus.subscribe(QrRotated, warm_rotated_qr)
+    bus.subscribe(QrRotated, notify_qr_rotated)
+    bus.subscribe(BotAuthed, notify_bot_authed)
+    bus.subscribe(BotDeauthed, notify_bot_deauthed)
+    bus.subscribe(BotSilent, notify_bot_silent)
+    bus.subscribe(BotResumed, notify_bot_resumed)
+    bus.subscribe(CustomNotify, deliver_custom_notification)
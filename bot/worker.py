@@ -0,0 +1,115 @@
+import asyncio
+from typing import List, Optional
+
+from bot.services.bot_connector import bot_connector
+from bot.services.digest import digest_buffer
+from bot.services.qr_sweeper import qr_sweeper
+from bot.services.subscribers import register_subscribers
+from core.config import settings
+from core.events import event_bus, InMemoryEventBus, RedisStreamEventBus
+from core.logger import logger
+from core.redis import close_redis
+from core.shutdown import drain
+from core.tracing import shutdown_tracing
+
+
+class DeliveryWorker:
+    """Telegram side of the service: polling, event delivery and QR housekeeping.
+
+    Runs inside the API process when ``EMBEDDED_WORKER`` is enabled, or as a
+    separate process via ``python -m bot.worker`` that consumes the events
+    the API publishes to the Redis stream.
+    """
+
+    def __init__(self):
+        self._polling_task: Optional[asyncio.Task] = None
+        self._consumer_task: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, handle_signals: bool = False):
+        """Start polling, event consumers and the QR sweeper in the background"""
+        bot_connector.prepare()
+        await bot_connector.load_assignments()
+        register_subscribers(event_bus)
+
+        self._polling_task = asyncio.create_task(bot_connector.start(handle_signals))
+        self._tasks = [self._polling_task]
+        if isinstance(event_bus, RedisStreamEventBus):
+            self._consumer_task = asyncio.create_task(event_bus.consume())
+            self._tasks.append(self._consumer_task)
+        elif isinstance(event_bus, InMemoryEventBus):
+            await event_bus.replay_spool()
+        if settings.QR_GC_ENABLED:
+            self._tasks.append(asyncio.create_task(qr_sweeper.start()))
+        logger.info("Delivery worker started")
+
+    async def stop(self):
+        """Drain in-flight deliveries within the shutdown deadline and stop every background task"""
+        drain.begin()
+        qr_sweeper.stop()
+
+        # Новые апдейты больше не забираем, начатые доделываем
+        await bot_connector.stop_polling()
+        await drain.wait_until_empty(bot_connector.pending_updates, "updates")
+
+        if isinstance(event_bus, RedisStreamEventBus):
+            # Текущая пачка дообрабатывается, непрочитанные события остаются в стриме
+            event_bus.stop()
+            if self._consumer_task:
+                await drain.wait_task(self._consumer_task)
+        elif isinstance(event_bus, InMemoryEventBus):
+            if await drain.wait_until_empty(event_bus.in_flight, "events"):
+                # Не успевшие к сроку события переживают рестарт в спуле
+                event_bus.spool_pending()
+
+        # Deliver buffered notification digests
+        drain.report.add("digests", await digest_buffer.flush_all())
+
+        await drain.wait_until_empty(bot_connector.pending_sends, "Telegram sends")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._polling_task = None
+        self._consumer_task = None
+
+        if isinstance(event_bus, RedisStreamEventBus):
+            try:
+                drain.report.add("unacknowledged events", 0, await event_bus.pending())
+            except Exception as e:
+                logger.error(f"Failed to count unacknowledged events: {e}")
+
+        await bot_connector.stop()
+        logger.info("Delivery worker stopped")
+
+    async def run(self):
+        """Run as a standalone process until polling is interrupted"""
+        if not isinstance(event_bus, RedisStreamEventBus):
+            raise RuntimeError("A standalone worker requires EVENT_BUS_BACKEND=redis")
+        if settings.STATE_BACKEND == "memory":
+            logger.warning("STATE_BACKEND=memory is not shared with the API process")
+
+        from scripts.init_db import init_db
+
+        await init_db()
+        await self.start(handle_signals=True)
+        try:
+            # start_polling возвращается по SIGINT/SIGTERM
+            await self._polling_task
+        finally:
+            await self.stop()
+            drain.finish()
+            await close_redis()
+            shutdown_tracing()
+
+
+# Create global delivery worker instance
+delivery_worker = DeliveryWorker()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(delivery_worker.run())
+    except KeyboardInterrupt:
+        pass
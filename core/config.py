@@ -1,11 +1,37 @@
 from pydantic_settings import BaseSettings
 from pydantic import SecretStr
-from typing import Optional
+from typing import Dict, List, Optional
 
 
 class Settings(BaseSettings):
     # Telegram Bot
     BOT_TOKEN: SecretStr
+    # More tokens to spread outbound traffic over, JSON list in env. Each user is
+    # pinned to the token they last talked to, so users must start those bots too.
+    BOT_TOKENS: List[SecretStr] = []
+    # Local Bot API server, e.g. http://localhost:8081 (None uses api.telegram.org)
+    BOT_API_URL: Optional[str] = None
+    BOT_API_LOCAL: bool = False  # server runs with --local (bigger uploads, file paths)
+
+    # Telegram HTTP session
+    BOT_SESSION_POOL_SIZE: int = 100  # total connections kept by the connector
+    BOT_SESSION_POOL_PER_HOST: int = 0  # 0 means no per-host limit
+    BOT_SESSION_KEEPALIVE: float = 30.0  # seconds an idle connection is kept open
+    BOT_SESSION_DNS_TTL: int = 300  # seconds DNS answers are cached
+    BOT_REQUEST_TIMEOUT: float = 60.0  # per-request timeout in seconds
+
+    # Telegram polling and update handling
+    BOT_POLLING_TIMEOUT: int = 10  # long-polling timeout of getUpdates in seconds
+    BOT_ALLOWED_UPDATES: Optional[List[str]] = None  # None requests only the types handlers use
+    BOT_UPDATE_CONCURRENCY: int = 32  # updates handled at once across chats, 0 means no limit
+
+    # Outbound Telegram scheduler: shared send budget and per-lane weights
+    OUTBOUND_RATE: float = 25.0  # requests per second, 0 means no limit
+    OUTBOUND_BURST: int = 5
+    OUTBOUND_WEIGHT_INTERACTIVE: int = 8
+    OUTBOUND_WEIGHT_AUTH_STATE: int = 4
+    OUTBOUND_WEIGHT_QR_ROTATION: int = 2
+    OUTBOUND_WEIGHT_BULK: int = 1
     
     # FastAPI
     API_HOST: str = "0.0.0.0"
@@ -17,7 +43,93 @@ class Settings(BaseSettings):
     
     # Redis
     REDIS_URL: Optional[str] = None
-    
+    REDIS_MAX_CONNECTIONS: int = 50  # shared pool size for every Redis user
+    REDIS_POOL_TIMEOUT: float = 5.0  # seconds to wait for a free connection
+
+    # Where QR message IDs and notification flags live: "memory", "redis" or "sql".
+    # Defaults to "redis" when REDIS_URL is set and "sql" otherwise.
+    STATE_BACKEND: Optional[str] = None
+
+    # aiogram FSM storage: "memory" or "redis", defaults to "redis" when REDIS_URL is set.
+    # Redis keys expire after the TTL (seconds, 0 keeps them), so idle chats do not pile up.
+    FSM_STORAGE: Optional[str] = None
+    FSM_STATE_TTL: int = 86400
+    FSM_DATA_TTL: int = 86400
+
+    # QR message garbage collector
+    QR_MESSAGE_TTL: int = 86400  # seconds a QR message is considered live
+    QR_GC_ENABLED: bool = True
+    QR_GC_INTERVAL: int = 3600  # seconds between sweeps
+    QR_GC_BATCH_SIZE: int = 20  # Telegram deletions per batch
+    QR_GC_BATCH_DELAY: float = 1.0  # seconds to wait between batches
+
+    # QR rendering
+    QR_RENDER_CACHE_SIZE: int = 256  # rendered payloads kept in memory
+    QR_TELEGRAM_FORMAT: str = "png1"  # "png" or "png1" (1-bit), Telegram photos cannot be SVG
+    QR_API_PNG_FORMAT: str = "png1"  # encoder behind GET /api/whatsapp/{bot_id}/qr.png
+    QR_API_ETAG_TTL: float = 5.0  # seconds a known QR hash answers conditional polls without a DB read, 0 disables
+    QR_WARMUP_ENABLED: bool = True  # pre-render new QR payloads on rotation
+    QR_CACHE_CHAT_ID: Optional[int] = None  # chat to pre-upload renders to for a reusable file_id
+
+    # Custom notification digests (window in seconds, 0 sends right away)
+    DIGEST_WINDOW: int = 0
+    DIGEST_BOT_WINDOWS: Dict[str, int] = {}  # per-bot override, JSON in env
+    DIGEST_MAX_ITEMS: int = 20
+    DIGEST_MAX_CHARS: int = 3500  # stays below Telegram's 4096 message limit
+
+    # Internal event bus: "memory" (in-process) or "redis" (stream + consumer group)
+    EVENT_BUS_BACKEND: str = "memory"
+    EVENT_STREAM: str = "gfp:events"
+    EVENT_STREAM_MAXLEN: int = 10000  # acknowledged events are trimmed above this length, unhandled ones never
+    EVENT_CONSUMER_GROUP: str = "gfp-delivery"
+    # Consumer name within the group, must stay the same across restarts of one worker
+    # and differ between workers. Defaults to the host name.
+    EVENT_CONSUMER_NAME: Optional[str] = None
+    EVENT_CLAIM_IDLE: int = 60  # seconds before unacknowledged events of another consumer are taken over
+    EVENT_MAX_DELIVERIES: int = 5  # deliveries before an event is moved to the dead-letter stream
+    EVENT_DEAD_LETTER_STREAM: str = "gfp:events:dead"
+    # Memory bus: events still unhandled at the shutdown deadline are written here and
+    # replayed on the next start. Empty logs each of them at error level instead.
+    EVENT_SPOOL_PATH: Optional[str] = "./event_spool.jsonl"
+    # Run Telegram polling and delivery inside the API process.
+    # Disable when running `python -m bot.worker` separately (needs EVENT_BUS_BACKEND=redis).
+    EMBEDDED_WORKER: bool = True
+
+    # Write-behind for QR rotations: seconds between batched writes, 0 writes through.
+    # Buffered QRs are visible to this process right away and to others after a flush,
+    # so it requires EMBEDDED_WORKER=true.
+    BOT_STATE_FLUSH_INTERVAL: float = 0
+
+    # Bot liveness: heartbeats are tracked in memory and last_seen is written in batches
+    BOT_HEARTBEAT_TIMEOUT: int = 120  # seconds without a report before linked users are told, 0 disables
+    BOT_PRESENCE_INTERVAL: int = 15  # seconds between silence checks and last_seen writes
+
+    # Ingestion admission control for QR updates and custom notifications (rate 0 disables)
+    ADMISSION_BACKEND: Optional[str] = None  # "memory" or "redis", defaults to "redis" when REDIS_URL is set
+    INGEST_RATE_PER_BOT: float = 2.0  # requests per second for one bot
+    INGEST_BURST_PER_BOT: int = 10
+    INGEST_RATE_GLOBAL: float = 50.0  # requests per second across all bots
+    INGEST_BURST_GLOBAL: int = 100
+    INGEST_MAX_IN_FLIGHT: int = 200  # requests in progress plus undelivered events
+
+    # Idempotency-Key replay for POST /api/whatsapp/* requests
+    IDEMPOTENCY_BACKEND: Optional[str] = None  # "memory" or "redis", defaults to "redis" when REDIS_URL is set
+    IDEMPOTENCY_TTL: int = 86400  # seconds a stored response can be replayed
+    IDEMPOTENCY_LOCK_TTL: int = 60  # seconds a key stays reserved while its first request runs
+
+    # Graceful shutdown: ingestion answers 503 while in-flight deliveries finish.
+    # Keep the timeout below systemd's TimeoutStopSec (90s by default).
+    SHUTDOWN_DRAIN_TIMEOUT: float = 20.0  # seconds for the whole drain
+    SHUTDOWN_RETRY_AFTER: int = 5  # Retry-After of rejected ingestion requests
+
+    # Tracing, needs opentelemetry-sdk (and opentelemetry-exporter-otlp-proto-http for "otlp").
+    # Exporter: "console", "file" (JSON lines), "otlp" (HTTP) or "memory" (tests); None disables.
+    TRACING_EXPORTER: Optional[str] = None
+    TRACING_FILE: str = "logs/traces.jsonl"
+    TRACING_OTLP_ENDPOINT: Optional[str] = None  # e.g. http://localhost:4318/v1/traces
+    TRACING_SERVICE_NAME: str = "gfp-watcher"
+    TRACING_SAMPLE_RATIO: float = 1.0  # share of new traces recorded, children follow the parent
+
     # Logging
     LOG_LEVEL: str = "DEBUG"
     
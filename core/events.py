@@ -0,0 +1,454 @@
+import asyncio
+import functools
+import json
+import os
+import socket
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, asdict, fields
+from typing import Awaitable, Callable, Dict, List, Optional, Type
+
+from core.config import settings
+from core.logger import logger
+from core.redis import redis_client
+from core.serial import KeyedSerialExecutor
+from core.tracing import span, inject_context, attached_context
+
+
+@dataclass
+class Event:
+    """Base class of internal events"""
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Event":
+        names = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in names})
+
+
+@dataclass
+class BotRegistered(Event):
+    bot_id: str
+    name: str
+
+
+@dataclass
+class QrRotated(Event):
+    bot_id: str
+    qr_data: str
+
+
+@dataclass
+class BotAuthed(Event):
+    bot_id: str
+
+
+@dataclass
+class BotDeauthed(Event):
+    bot_id: str
+
+
+@dataclass
+class BotSilent(Event):
+    bot_id: str
+    last_seen: float  # unix time of the last report
+
+
+@dataclass
+class BotResumed(Event):
+    bot_id: str
+
+
+@dataclass
+class CustomNotify(Event):
+    bot_id: str
+    sender_name: str
+    message: str
+    urgent: bool = False
+
+
+EVENT_TYPES: Dict[str, Type[Event]] = {
+    event_type.__name__: event_type
+    for event_type in (BotRegistered, QrRotated, BotAuthed, BotDeauthed, BotSilent, BotResumed, CustomNotify)
+}
+
+Handler = Callable[[Event], Awaitable[None]]
+
+
+class EventBus(ABC):
+    """Publishes events to independently subscribed handlers.
+
+    Handlers of one event run concurrently; a failing handler is logged and
+    does not affect the others. Events of one bot are dispatched one at a
+    time in publishing order, events of different bots concurrently.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[Type[Event], List[Handler]] = {}
+        self._serial = KeyedSerialExecutor()
+
+    def subscribe(self, event_type: Type[Event], handler: Handler = None):
+        """Subscribe a handler, usable as a decorator"""
+        def register(func: Handler) -> Handler:
+            self._handlers.setdefault(event_type, []).append(func)
+            return func
+        return register(handler) if handler else register
+
+    @abstractmethod
+    async def publish(self, event: Event):
+        """Hand the event over for delivery to its handlers"""
+
+    @abstractmethod
+    async def backlog(self) -> int:
+        """Events published but not handled yet"""
+
+    @staticmethod
+    def order_key(event: Event) -> Optional[str]:
+        return getattr(event, "bot_id", None)
+
+    async def dispatch(self, event: Event):
+        """Run every handler of the event concurrently"""
+        handlers = self._handlers.get(type(event), [])
+        if not handlers:
+            return
+        with span(f"event {type(event).__name__}", **{"event.handlers": len(handlers)}):
+            results = await asyncio.gather(*(handler(event) for handler in handlers), return_exceptions=True)
+        for handler, result in zip(handlers, results):
+            if isinstance(result, Exception):
+                logger.error(f"Event handler {handler.__name__} failed for {type(event).__name__}: {result}")
+
+
+class InMemoryEventBus(EventBus):
+    """Dispatches events in background tasks of the publishing process.
+
+    Events are lost with the process, so the ones still unhandled at the
+    shutdown deadline are spooled to ``spool_path`` and published again by
+    ``replay_spool`` on the next start.
+    """
+
+    def __init__(self, spool_path: Optional[str] = None):
+        super().__init__()
+        self.spool_path = spool_path
+        self._tasks: Dict[asyncio.Task, Event] = {}
+
+    async def publish(self, event: Event):
+        # Задачи стартуют в порядке создания, поэтому очередь бота сохраняет порядок публикации
+        task = asyncio.create_task(self._serial.run(self.order_key(event), lambda: self.dispatch(event)))
+        self._tasks[task] = event
+        task.add_done_callback(lambda done: self._tasks.pop(done, None))
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def backlog(self) -> int:
+        return self.in_flight()
+
+    async def wait_idle(self):
+        """Wait until every published event has been handled"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def spool_pending(self) -> int:
+        """Stop unhandled events and save them for the next start, return how many were saved"""
+        tasks = dict(self._tasks)
+        if not tasks:
+            return 0
+        # Недоставленное событие повторится после рестарта, поэтому текущую попытку прерываем
+        for task in tasks:
+            task.cancel()
+        lines = [json.dumps({"type": type(event).__name__, "payload": event.to_dict()}) for event in tasks.values()]
+        if self.spool_path:
+            try:
+                with open(self.spool_path, "a", encoding="utf-8") as spool:
+                    spool.writelines(line + "\n" for line in lines)
+                logger.warning(f"Spooled {len(lines)} unhandled events to {self.spool_path}")
+                return len(lines)
+            except OSError as e:
+                logger.error(f"Failed to spool unhandled events to {self.spool_path}: {e}")
+        for line in lines:
+            logger.error(f"Dropped unhandled event: {line}")
+        return 0
+
+    async def replay_spool(self) -> int:
+        """Publish the events spooled by the previous run, return their number"""
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return 0
+        with open(self.spool_path, encoding="utf-8") as spool:
+            lines = spool.read().splitlines()
+        os.remove(self.spool_path)
+
+        replayed = 0
+        for line in lines:
+            try:
+                data = json.loads(line)
+                event = EVENT_TYPES[data["type"]].from_dict(data["payload"])
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error(f"Skipped undecodable spooled event {line!r}: {e}")
+                continue
+            await self.publish(event)
+            replayed += 1
+        logger.info(f"Replayed {replayed} spooled events from {self.spool_path}")
+        return replayed
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+# Сколько секунд переиспользуем замер отставания группы, чтобы не ходить в Redis на каждый запрос
+BACKLOG_CACHE_TTL = 1.0
+
+
+def _id_key(stream_id: str):
+    milliseconds, _, sequence = stream_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+class RedisStreamEventBus(EventBus):
+    """Publishes events to a Redis stream read by a consumer group.
+
+    Consumers may live in any process; every event is handled by exactly one
+    consumer of the group and acknowledged once all its handlers have run.
+    Events a consumer read but never acknowledged are read again when it
+    restarts under the same name, or taken over by any consumer once they
+    are ``claim_idle`` seconds old. Events that cannot be decoded, or were
+    delivered ``max_deliveries`` times, go to the dead-letter stream.
+
+    Publishing does not trim the stream: once it holds more than ``maxlen``
+    entries the consumer drops the ones every group has read and
+    acknowledged, so an unread backlog is never cut off.
+    """
+
+    def __init__(self, client, stream: str, group: str, maxlen: int, consumer: Optional[str] = None,
+                 claim_idle: int = 60, max_deliveries: int = 5, dead_letter_stream: Optional[str] = None):
+        super().__init__()
+        self.redis = client
+        self.stream = stream
+        self.group = group
+        self.maxlen = maxlen
+        self.consumer = consumer or socket.gethostname()
+        self.claim_idle = claim_idle
+        self.max_deliveries = max_deliveries
+        self.dead_letter_stream = dead_letter_stream or f"{stream}:dead"
+        self._stopped = asyncio.Event()
+        self._backlog = (0, float("-inf"))  # (events, loop time of the measurement)
+
+    async def publish(self, event: Event):
+        fields_map = {"type": type(event).__name__, "payload": json.dumps(event.to_dict())}
+        # Контекст трассировки едет вместе с событием к потребителю в другом процессе
+        carrier = inject_context()
+        if carrier:
+            fields_map["trace"] = json.dumps(carrier)
+        await self.redis.xadd(self.stream, fields_map)
+
+    async def _ensure_group(self):
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _dead_letter(self, message_id, fields_map: dict, reason: str):
+        """Move the event to the dead-letter stream and acknowledge it"""
+        logger.error(f"Moving event {_decode(message_id)} to {self.dead_letter_stream}: {reason}")
+        # Мертвые события ждут разбора оператором, поэтому поток не обрезаем
+        await self.redis.xadd(
+            self.dead_letter_stream,
+            {**fields_map, "id": _decode(message_id), "reason": reason}
+        )
+        await self.redis.xack(self.stream, self.group, message_id)
+
+    async def _handle(self, message_id, fields_map: dict):
+        try:
+            event_type = EVENT_TYPES[fields_map.get("type")]
+            event = event_type.from_dict(json.loads(fields_map["payload"]))
+            carrier = json.loads(fields_map["trace"]) if "trace" in fields_map else None
+        except Exception as e:
+            # Повторная доставка не поможет, событие не разобрать
+            await self._dead_letter(message_id, fields_map, f"undecodable: {e!r}")
+            return
+        with attached_context(carrier):
+            await self.dispatch(event)
+        await self.redis.xack(self.stream, self.group, message_id)
+
+    def _message_key(self, fields_map: dict) -> Optional[str]:
+        try:
+            return json.loads(fields_map["payload"]).get("bot_id")
+        except Exception:
+            return None
+
+    async def _handle_batch(self, messages: list):
+        messages = [
+            (message_id, {_decode(key): _decode(value) for key, value in data.items()})
+            for message_id, data in messages
+        ]
+        # Пачку обрабатываем параллельно по ботам, события одного бота - по порядку
+        calls = [
+            self._serial.run(self._message_key(data), functools.partial(self._handle, message_id, data))
+            for message_id, data in messages
+        ]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Failed to handle event from {self.stream}: {result}")
+
+    async def claim_stale(self) -> int:
+        """Take over events other consumers left unacknowledged, return how many"""
+        claimed = 0
+        start_id = "0-0"
+        while True:
+            response = await self.redis.xautoclaim(
+                self.stream, self.group, self.consumer,
+                min_idle_time=self.claim_idle * 1000, start_id=start_id, count=100
+            )
+            # Ответ: следующий курсор, забранные события, ID удаленных из стрима
+            start_id, messages = _decode(response[0]), response[1]
+            claimed += len(messages)
+            if start_id == "0-0":
+                break
+        if claimed:
+            logger.warning(f"Claimed {claimed} unacknowledged events from {self.stream}")
+        return claimed
+
+    async def trim(self) -> int:
+        """Drop events every group has acknowledged once the stream is over ``maxlen``, return how many"""
+        if await self.redis.xlen(self.stream) <= self.maxlen:
+            return 0
+        # Самое старое нужное событие: последнее выданное группе или самое старое неподтвержденное
+        keep_from = None
+        for group in await self.redis.xinfo_groups(self.stream):
+            oldest = _decode(group["last-delivered-id"])
+            if group["pending"]:
+                pending = await self.redis.xpending(self.stream, _decode(group["name"]))
+                oldest = min(oldest, _decode(pending["min"]), key=_id_key)
+            keep_from = oldest if keep_from is None else min(keep_from, oldest, key=_id_key)
+        if keep_from is None:
+            return 0
+
+        # Точная обрезка: после нее в стриме остаются только необработанные события
+        trimmed = await self.redis.xtrim(self.stream, minid=keep_from, approximate=False)
+        length = await self.redis.xlen(self.stream)
+        if length > self.maxlen:
+            logger.warning(
+                f"{self.stream} holds {length} unhandled events, above EVENT_STREAM_MAXLEN={self.maxlen}; "
+                f"delivery is falling behind"
+            )
+        return trimmed
+
+    async def _drop_exhausted(self):
+        """Dead-letter pending events of this consumer delivered too many times"""
+        entries = await self.redis.xpending_range(
+            self.stream, self.group, min="-", max="+", count=1000, consumername=self.consumer
+        )
+        for entry in entries:
+            if entry["times_delivered"] <= self.max_deliveries:
+                continue
+            message_id = entry["message_id"]
+            found = await self.redis.xrange(self.stream, min=message_id, max=message_id)
+            fields_map = {_decode(key): _decode(value) for key, value in found[0][1].items()} if found else {}
+            await self._dead_letter(message_id, fields_map, f"delivered {entry['times_delivered']} times")
+
+    async def consume(self, batch_size: int = 50, block_ms: int = 5000):
+        """Read and dispatch events until stopped"""
+        await self._ensure_group()
+        self._stopped.clear()
+        logger.info(f"Consuming events from {self.stream} as {self.group}/{self.consumer}")
+
+        # Сначала дочитываем неподтвержденные события этого потребителя, затем новые
+        last_id = "0"
+        claimed_at = None
+        loop = asyncio.get_running_loop()
+        while not self._stopped.is_set():
+            try:
+                # Время от времени забираем события упавших потребителей
+                if claimed_at is None or loop.time() - claimed_at >= self.claim_idle:
+                    claimed_at = loop.time()
+                    if await self.claim_stale():
+                        last_id = "0"
+                    await self.trim()
+                if last_id == "0":
+                    await self._drop_exhausted()
+                response = await self.redis.xreadgroup(
+                    self.group, self.consumer, {self.stream: last_id},
+                    count=batch_size, block=None if last_id != ">" else block_ms
+                )
+            except Exception as e:
+                logger.error(f"Failed to read events from {self.stream}: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            messages = response[0][1] if response else []
+            if last_id != ">":
+                if not messages:
+                    last_id = ">"
+                    continue
+                # Историю читаем дальше от последнего ID, а не с начала, чтобы не крутиться на
+                # событии, которое не удалось подтвердить
+                last_id = _decode(messages[-1][0])
+            await self._handle_batch(messages)
+
+    async def backlog(self) -> int:
+        """Events the group has not read yet plus those read but not acknowledged, cached briefly"""
+        count, measured_at = self._backlog
+        now = asyncio.get_running_loop().time()
+        if now - measured_at < BACKLOG_CACHE_TTL:
+            return count
+        try:
+            groups = await self.redis.xinfo_groups(self.stream)
+            group = next((group for group in groups if _decode(group["name"]) == self.group), None)
+            if group is None:
+                # Группу создает потребитель; пока его не было, не прочитано все, что есть в стриме
+                count = await self.redis.xlen(self.stream)
+            elif group.get("lag") is not None:
+                count = int(group["lag"]) + int(group["pending"])
+            else:
+                # Redis до 7.0 не считает lag: пересчитываем непрочитанное, но не дальше предела
+                unread = await self.redis.xrange(
+                    self.stream, min="(" + _decode(group["last-delivered-id"]), max="+",
+                    count=settings.INGEST_MAX_IN_FLIGHT
+                )
+                count = len(unread) + int(group["pending"])
+        except Exception as e:
+            if "no such key" in str(e).lower():
+                # Стрима еще нет - нет и очереди
+                count = 0
+            else:
+                logger.warning(f"Failed to measure the backlog of {self.stream}: {e}")
+        self._backlog = (count, now)
+        return count
+
+    async def pending(self) -> int:
+        """Events read by this consumer but not acknowledged, read again on its next start"""
+        info = await self.redis.xpending(self.stream, self.group)
+        for consumer in info.get("consumers") or []:
+            if _decode(consumer["name"]) == self.consumer:
+                return int(consumer["pending"])
+        return 0
+
+    def stop(self):
+        self._stopped.set()
+
+
+def create_event_bus() -> EventBus:
+    """Create the event bus selected by ``EVENT_BUS_BACKEND``"""
+    if settings.EVENT_BUS_BACKEND == "redis":
+        if not redis_client:
+            raise RuntimeError("EVENT_BUS_BACKEND=redis requires REDIS_URL to be set")
+        return RedisStreamEventBus(
+            redis_client,
+            stream=settings.EVENT_STREAM,
+            group=settings.EVENT_CONSUMER_GROUP,
+            maxlen=settings.EVENT_STREAM_MAXLEN,
+            consumer=settings.EVENT_CONSUMER_NAME,
+            claim_idle=settings.EVENT_CLAIM_IDLE,
+            max_deliveries=settings.EVENT_MAX_DELIVERIES,
+            dead_letter_stream=settings.EVENT_DEAD_LETTER_STREAM
+        )
+    if settings.EVENT_BUS_BACKEND == "memory":
+        return InMemoryEventBus(spool_path=settings.EVENT_SPOOL_PATH)
+    raise ValueError(f"Unknown event bus backend: {settings.EVENT_BUS_BACKEND}")
+
+
+# Create global event bus instance
+event_bus = create_event_bus()
@@ -0,0 +1,24 @@
+from typing import Optional, TYPE_CHECKING
+
+from core.config import settings
+
+if TYPE_CHECKING:
+    import redis.asyncio as redis
+
+# Initialize Redis client if URL is provided, the client library is only loaded when needed.
+# Every Redis user (state store, event bus, admission, idempotency, FSM storage) shares this
+# client and its pool; a blocking pool waits for a free connection instead of failing.
+redis_client: Optional["redis.Redis"] = None
+if settings.REDIS_URL:
+    import redis.asyncio as redis
+    redis_client = redis.Redis(connection_pool=redis.BlockingConnectionPool.from_url(
+        settings.REDIS_URL,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT
+    ))
+
+
+async def close_redis():
+    """Close the shared connection pool at exit"""
+    if redis_client is not None:
+        await redis_client.aclose(close_connection_pool=True)
@@ -0,0 +1,55 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class KeyedSerialExecutor:
+    """Runs calls with the same key one at a time, in arrival order.
+
+    Calls with different keys run concurrently, at most ``limit`` at once
+    (0 means no limit). A key's lock lives only while calls for it are
+    running or waiting.
+    """
+
+    def __init__(self, limit: int = 0):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self._slots: Optional[asyncio.Semaphore] = asyncio.Semaphore(limit) if limit > 0 else None
+        self._calls = 0
+
+    def active_keys(self) -> int:
+        return len(self._locks)
+
+    def pending(self) -> int:
+        """Number of calls running or waiting for their turn"""
+        return self._calls
+
+    async def run(self, key: Optional[Hashable], call: Callable[[], Awaitable[Any]]) -> Any:
+        self._calls += 1
+        try:
+            return await self._run_keyed(key, call)
+        finally:
+            self._calls -= 1
+
+    async def _run_keyed(self, key: Optional[Hashable], call: Callable[[], Awaitable[Any]]) -> Any:
+        if key is None:
+            return await self._run_in_slot(call)
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # asyncio.Lock будит ожидающих по очереди, поэтому порядок сохраняется
+            async with lock:
+                return await self._run_in_slot(call)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def _run_in_slot(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        if self._slots is None:
+            return await call()
+        async with self._slots:
+            return await call()
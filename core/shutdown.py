@@ -0,0 +1,91 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+from core.config import settings
+from core.logger import logger
+
+# Как часто проверяем, не опустела ли очередь
+DRAIN_POLL_INTERVAL = 0.05
+
+
+@dataclass
+class DrainReport:
+    """Work finished during shutdown and work left behind, by kind"""
+    drained: Dict[str, int] = field(default_factory=dict)
+    left: Dict[str, int] = field(default_factory=dict)
+
+    def add(self, name: str, drained: int, left: int = 0):
+        if drained:
+            self.drained[name] = self.drained.get(name, 0) + drained
+        if left:
+            self.left[name] = self.left.get(name, 0) + left
+
+    def summary(self) -> str:
+        drained = ", ".join(f"{count} {name}" for name, count in self.drained.items()) or "nothing"
+        text = f"Drained {drained}"
+        if self.left:
+            text += "; left " + ", ".join(f"{count} {name}" for name, count in self.left.items())
+        return text
+
+
+class Drain:
+    """Shutdown protocol shared by the API and the delivery worker.
+
+    Once closed, endpoints that publish events answer 503. ``begin`` closes
+    ingestion and starts one deadline, ``SHUTDOWN_DRAIN_TIMEOUT`` seconds
+    away, that every shutdown step waits for its work until. Steps record
+    what they finished and what they had to leave in ``report``.
+    """
+
+    def __init__(self):
+        self.closed = False  # ingestion is refused
+        self.deadline: Optional[float] = None
+        self.report = DrainReport()
+
+    def close(self):
+        """Refuse new ingestion, e.g. ahead of a rolling restart"""
+        if not self.closed:
+            self.closed = True
+            logger.warning("Ingestion is closed, requests get 503 until restart")
+
+    def begin(self, timeout: Optional[float] = None):
+        """Close ingestion and start the deadline, a repeated call keeps the first deadline"""
+        self.close()
+        if self.deadline is not None:
+            return
+        timeout = settings.SHUTDOWN_DRAIN_TIMEOUT if timeout is None else timeout
+        self.deadline = time.monotonic() + timeout
+        logger.info(f"Draining in-flight work within {timeout}s")
+
+    def remaining(self) -> float:
+        if self.deadline is None:
+            return settings.SHUTDOWN_DRAIN_TIMEOUT
+        return max(0.0, self.deadline - time.monotonic())
+
+    async def wait_until_empty(self, pending: Callable[[], int], name: str) -> int:
+        """Wait until ``pending()`` drops to zero or the deadline passes, return what is left"""
+        started = pending()
+        while pending() and self.remaining() > 0:
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+        left = pending()
+        self.report.add(name, max(started - left, 0), left)
+        return left
+
+    async def wait_task(self, task: asyncio.Task) -> bool:
+        """Give the task until the deadline to finish, return True if it did"""
+        done, _ = await asyncio.wait({task}, timeout=self.remaining())
+        return bool(done)
+
+    def finish(self) -> DrainReport:
+        """Log the report of the finished drain"""
+        if self.report.left:
+            logger.warning(self.report.summary())
+        else:
+            logger.info(self.report.summary())
+        return self.report
+
+
+# Create global drain instance
+drain = Drain()
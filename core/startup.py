@@ -0,0 +1,38 @@
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+from core.logger import logger
+
+
+class StartupTimer:
+    """Collects a timing breakdown of application startup"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self._last = self.started_at
+        self.steps: List[Tuple[str, float]] = []
+
+    def mark(self, name: str):
+        """Record the time spent since the previous mark"""
+        now = time.perf_counter()
+        self.steps.append((name, now - self._last))
+        self._last = now
+
+    @contextmanager
+    def step(self, name: str):
+        """Record the time spent inside the block"""
+        self._last = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name)
+
+    def report(self):
+        total = time.perf_counter() - self.started_at
+        breakdown = ", ".join(f"{name} {duration * 1000:.0f}ms" for name, duration in self.steps)
+        logger.info(f"Startup finished in {total * 1000:.0f}ms ({breakdown})")
+
+
+# Created on first import, so the "imports" step covers module loading
+startup_timer = StartupTimer()
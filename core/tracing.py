@@ -0,0 +1,211 @@
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import Response
+
+from core.config import settings
+from core.logger import logger
+
+try:
+    from opentelemetry import context as otel_context, propagate, trace
+except ImportError:  # opentelemetry-api/sdk are optional, tracing is off without them
+    trace = None
+
+# Длинные SQL обрезаем, чтобы не раздувать экспорт
+MAX_STATEMENT_LENGTH = 1000
+
+_memory_exporter = None
+
+
+def _create_exporter(name: str):
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter, SpanExporter, SpanExportResult
+
+    if name == "console":
+        return ConsoleSpanExporter()
+
+    if name == "file":
+        class FileSpanExporter(SpanExporter):
+            """Appends finished spans to a JSON lines file"""
+
+            def __init__(self, path: str):
+                self.path = path
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+            def export(self, spans):
+                with open(self.path, "a", encoding="utf-8") as file:
+                    for span in spans:
+                        file.write(span.to_json(indent=None) + "\n")
+                return SpanExportResult.SUCCESS
+
+        return FileSpanExporter(settings.TRACING_FILE)
+
+    if name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        return OTLPSpanExporter(endpoint=settings.TRACING_OTLP_ENDPOINT)
+
+    if name == "memory":
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+        global _memory_exporter
+        _memory_exporter = InMemorySpanExporter()
+        return _memory_exporter
+
+    raise ValueError(f"Unknown tracing exporter: {name}")
+
+
+def create_tracer():
+    """Configure the tracer provider selected by ``TRACING_EXPORTER``, None when tracing is off"""
+    if not settings.TRACING_EXPORTER:
+        return None
+    if trace is None:
+        logger.warning("TRACING_EXPORTER is set but opentelemetry-sdk is not installed, tracing is off")
+        return None
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    exporter = _create_exporter(settings.TRACING_EXPORTER)
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(settings.TRACING_SAMPLE_RATIO))
+    )
+    # В памяти и в консоли спаны нужны сразу, в файл и OTLP пишем пакетами
+    processor = SimpleSpanProcessor if settings.TRACING_EXPORTER in ("memory", "console") else BatchSpanProcessor
+    provider.add_span_processor(processor(exporter))
+    trace.set_tracer_provider(provider)
+    logger.info(f"Tracing enabled with the {settings.TRACING_EXPORTER} exporter")
+    return trace.get_tracer("gfp_watcher")
+
+
+# Create global tracer instance
+tracer = create_tracer()
+
+
+def _attributes(attributes: dict) -> dict:
+    return {key: value for key, value in attributes.items() if value is not None}
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Run the block in a child span of the current one, a no-op when tracing is off"""
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=_attributes(attributes)) as current:
+        yield current
+
+
+def traced(name: Optional[str] = None):
+    """Decorator version of :func:`span` for coroutine functions"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def inject_context() -> Dict[str, str]:
+    """Trace context of the current span as W3C headers, for work handed to another process"""
+    carrier: Dict[str, str] = {}
+    if tracer is not None:
+        propagate.inject(carrier)
+    return carrier
+
+
+@contextmanager
+def attached_context(carrier: Optional[Dict[str, str]]):
+    """Continue the trace described by ``carrier`` inside the block"""
+    if tracer is None or not carrier:
+        yield
+        return
+    token = otel_context.attach(propagate.extract(carrier))
+    try:
+        yield
+    finally:
+        otel_context.detach(token)
+
+
+def finished_spans() -> list:
+    """Spans recorded by the ``memory`` exporter"""
+    return list(_memory_exporter.get_finished_spans()) if _memory_exporter else []
+
+
+def shutdown_tracing():
+    """Export buffered spans before exit"""
+    if tracer is not None:
+        trace.get_tracer_provider().shutdown()
+
+
+def instrument_engine(engine):
+    """Record a span for every SQL statement executed by the engine"""
+    if tracer is None:
+        return
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        current = tracer.start_span(
+            f"db {statement.split(None, 1)[0].upper() if statement.strip() else 'SQL'}",
+            kind=trace.SpanKind.CLIENT,
+            attributes={
+                "db.system": conn.dialect.name,
+                "db.statement": statement[:MAX_STATEMENT_LENGTH],
+                "db.executemany": executemany,
+            }
+        )
+        conn.info.setdefault("tracing_spans", []).append(current)
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("tracing_spans")
+        if spans:
+            spans.pop().end()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        spans = exception_context.connection.info.get("tracing_spans") if exception_context.connection else None
+        if spans:
+            current = spans.pop()
+            current.record_exception(exception_context.original_exception)
+            current.set_status(trace.Status(trace.StatusCode.ERROR))
+            current.end()
+
+
+class TracingMiddleware(BaseHTTPMiddleware):
+    """Wraps every HTTP request in a server span, continuing a ``traceparent`` sent by the client"""
+
+    async def dispatch(self, request: Request, call_next) -> Response:
+        if tracer is None:
+            return await call_next(request)
+
+        started_at = time.perf_counter()
+        with attached_context(dict(request.headers)):
+            with tracer.start_as_current_span(
+                f"{request.method} {request.url.path}",
+                kind=trace.SpanKind.SERVER,
+                attributes={"http.method": request.method, "http.target": request.url.path}
+            ) as current:
+                response = await call_next(request)
+                route = request.scope.get("route")
+                if route is not None:
+                    current.update_name(f"{request.method} {route.path}")
+                    current.set_attribute("http.route", route.path)
+                current.set_attribute("http.status_code", response.status_code)
+                current.set_attribute("http.duration_ms", round((time.perf_counter() - started_at) * 1000, 1))
+                if response.status_code >= 500:
+                    current.set_status(trace.Status(trace.StatusCode.ERROR))
+                return response
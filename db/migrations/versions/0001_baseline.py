@@ -0,0 +1,59 @@
+"""Baseline schema
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-18 12:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001_baseline'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Базы, созданные через create_all до появления миграций, уже содержат таблицы
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'bots' not in existing:
+        op.create_table(
+            'bots',
+            sa.Column('id', sa.String(length=32), nullable=False),
+            sa.Column('name', sa.String(length=50), nullable=True),
+            sa.Column('description', sa.String(length=200), nullable=True),
+            sa.Column('current_qr', sa.Text(), nullable=True),
+            sa.Column('authed', sa.Boolean(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'users' not in existing:
+        op.create_table(
+            'users',
+            sa.Column('tg_id', sa.BigInteger(), nullable=False),
+            sa.Column('data', sa.JSON(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('tg_id')
+        )
+    if 'users_bots_mul' not in existing:
+        op.create_table(
+            'users_bots_mul',
+            sa.Column('user_id', sa.BigInteger(), nullable=False),
+            sa.Column('bot_id', sa.String(length=32), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['bot_id'], ['bots.id']),
+            sa.ForeignKeyConstraint(['user_id'], ['users.tg_id']),
+            sa.PrimaryKeyConstraint('user_id', 'bot_id')
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('users_bots_mul')
+    op.drop_table('users')
+    op.drop_table('bots')
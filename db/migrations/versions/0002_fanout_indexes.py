@@ -0,0 +1,41 @@
+"""Indexes for fan-out queries
+
+Revision ID: 0002_fanout_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-18 12:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002_fanout_indexes'
+down_revision: Union[str, None] = '0001_baseline'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _existing_indexes(table: str) -> set:
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade() -> None:
+    # Первичный ключ (user_id, bot_id) не помогает при выборке по bot_id
+    if 'ix_users_bots_mul_bot_id_user_id' not in _existing_indexes('users_bots_mul'):
+        op.create_index('ix_users_bots_mul_bot_id_user_id', 'users_bots_mul', ['bot_id', 'user_id'])
+
+    # Частичный индекс: неавторизованных ботов мало, а ищут именно их
+    if 'ix_bots_pending_auth' not in _existing_indexes('bots'):
+        op.create_index(
+            'ix_bots_pending_auth', 'bots', ['id'],
+            sqlite_where=sa.text('authed = 0'),
+            postgresql_where=sa.text('authed = false')
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_bots_pending_auth', table_name='bots')
+    op.drop_index('ix_users_bots_mul_bot_id_user_id', table_name='users_bots_mul')
@@ -0,0 +1,29 @@
+"""Last heartbeat time of bots
+
+Revision ID: 0003_bot_last_seen
+Revises: 0002_fanout_indexes
+Create Date: 2026-10-19 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003_bot_last_seen'
+down_revision: Union[str, None] = '0002_fanout_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('bots')}
+    if 'last_seen' not in columns:
+        op.add_column('bots', sa.Column('last_seen', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('bots') as batch_op:
+        batch_op.drop_column('last_seen')
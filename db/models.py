@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, String, BigInteger, Boolean, DateTime, ForeignKey, Text, JSON, func
+from sqlalchemy import Column, String, BigInteger, Boolean, DateTime, ForeignKey, Index, Text, JSON, func
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
@@ -14,9 +14,15 @@ class Bot(Base):
     current_qr = Column(Text)
     authed = Column(Boolean, default=False)
     created_at = Column(DateTime, default=func.now())
+    last_seen = Column(DateTime)  # last heartbeat, written in batches by the presence tracker
     
     users = relationship('User', secondary='users_bots_mul', back_populates='bots')
 
+    __table_args__ = (
+        # Bots still waiting for a QR scan
+        Index('ix_bots_pending_auth', id, sqlite_where=authed == False, postgresql_where=authed == False),  # noqa: E712
+    )
+
 
 class User(Base):
     __tablename__ = 'users'
@@ -33,4 +39,9 @@ class UserBotAssociation(Base):
     
     user_id = Column(BigInteger, ForeignKey('users.tg_id'), primary_key=True)
     bot_id = Column(String(32), ForeignKey('bots.id'), primary_key=True)
-    created_at = Column(DateTime, default=func.now()) 
\ No newline at end of file
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        # Fan-out by bot: the primary key (user_id, bot_id) cannot serve bot_id lookups
+        Index('ix_users_bots_mul_bot_id_user_id', bot_id, user_id),
+    )
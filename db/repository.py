@@ -1,12 +1,24 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
+from sqlalchemy import select, update, delete, insert, exists, literal, bindparam, case, cast, func
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.types import JSON, Text
 from sqlalchemy.orm import selectinload
 
 from db.models import Bot, User, UserBotAssociation
+from db.write_behind import bot_state_buffer
 from core.logger import logger
 
 
+def _sqlite_json_path(*keys: str) -> str:
+    """JSON path to nested object keys, SQLite cannot escape a quote inside a key"""
+    for key in keys:
+        if '"' in key:
+            raise ValueError(f"Key {key!r} cannot be used in a SQLite JSON path")
+    return "$" + "".join(f'."{key}"' for key in keys)
+
+
 class BotRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
@@ -17,14 +29,54 @@ class BotRepository:
         await self.session.commit()
         logger.info(f"Created new bot: {bot_id}")
         return bot
+
+    def _insert(self, model):
+        """Dialect-specific INSERT that supports ON CONFLICT"""
+        if self.session.get_bind().dialect.name == "postgresql":
+            return pg_insert(model)
+        return sqlite_insert(model)
+
+    async def create_bot_if_absent(self, bot_id: str, name: str, description: str, commit: bool = True) -> bool:
+        """Insert the bot unless it already exists, return True if it was created"""
+        result = await self.session.execute(
+            self._insert(Bot)
+            .values(id=bot_id, name=name, description=description)
+            .on_conflict_do_nothing(index_elements=[Bot.id])
+        )
+        if commit:
+            await self.session.commit()
+        return result.rowcount > 0
+
+    async def upsert_bot(self, bot_id: str, name: str, description: str) -> Tuple[Bot, bool]:
+        """Create the bot or refresh its name and description, return (bot, created)"""
+        created = await self.create_bot_if_absent(bot_id, name, description, commit=False)
+        if not created:
+            await self.session.execute(
+                update(Bot)
+                .where(Bot.id == bot_id)
+                .values(name=name, description=description)
+            )
+        await self.session.commit()
+
+        result = await self.session.execute(
+            select(Bot)
+            .where(Bot.id == bot_id)
+            .execution_options(populate_existing=True)
+        )
+        logger.info(f"{'Created' if created else 'Refreshed'} bot: {bot_id}")
+        return result.scalar_one(), created
     
     async def get_bot(self, bot_id: str) -> Optional[Bot]:
         result = await self.session.execute(
             select(Bot).where(Bot.id == bot_id)
         )
-        return result.scalar_one_or_none()
+        return bot_state_buffer.overlay(result.scalar_one_or_none())
     
     async def update_qr(self, bot_id: str, qr_data: str) -> bool:
+        if bot_state_buffer.enabled:
+            # Запись уйдет в БД пакетом при следующем сбросе буфера
+            bot_state_buffer.set_qr(bot_id, qr_data)
+            return True
         result = await self.session.execute(
             update(Bot)
             .where(Bot.id == bot_id)
@@ -34,22 +86,41 @@ class BotRepository:
         logger.info(f"Updated QR for bot: {bot_id}")
         return result.rowcount > 0
     
-    async def update_auth_state(self, bot_id: str, authed: bool) -> bool:
+    async def update_auth_state(self, bot_id: str, authed: bool, commit: bool = True) -> bool:
         result = await self.session.execute(
             update(Bot)
             .where(Bot.id == bot_id)
             .values(authed=authed)
         )
-        await self.session.commit()
+        if commit:
+            await self.session.commit()
         logger.info(f"Updated auth state for bot {bot_id}: {authed}")
         return result.rowcount > 0
     
-    async def get_unlinked_bots(self, user_id: int) -> List[Bot]:
+    async def get_pending_auth_bots(self, user_id: int) -> List[Bot]:
+        """Unauthenticated bots linked to the user, ordered by name"""
         result = await self.session.execute(
             select(Bot)
-            .outerjoin(UserBotAssociation)
-            .where(UserBotAssociation.user_id.is_(None))
+            .join(UserBotAssociation, UserBotAssociation.bot_id == Bot.id)
+            .where(UserBotAssociation.user_id == user_id)
+            .where(Bot.authed == False)  # noqa: E712
+            .order_by(Bot.name, Bot.id)
         )
+        return [bot_state_buffer.overlay(bot) for bot in result.scalars().all()]
+
+    @staticmethod
+    def _linked_to(user_id: int):
+        return exists().where(
+            UserBotAssociation.user_id == user_id,
+            UserBotAssociation.bot_id == Bot.id
+        )
+
+    async def get_unlinked_bots(self, user_id: int, after: Optional[str] = None, limit: int = 50) -> List[Bot]:
+        """Bots the user can still link, ordered by ID, starting after the given ID"""
+        query = select(Bot).where(~self._linked_to(user_id))
+        if after is not None:
+            query = query.where(Bot.id > after)
+        result = await self.session.execute(query.order_by(Bot.id).limit(limit))
         return list(result.scalars().all())
     
     async def link_bot_to_user(self, user_id: int, bot_id: str) -> bool:
@@ -63,13 +134,46 @@ class BotRepository:
             await self.session.rollback()
             logger.error(f"Failed to link bot {bot_id} to user {user_id}: {e}")
             return False
-    async def delete_qr(self, bot_id: str) -> bool:
+
+    async def link_bots_to_user(self, user_id: int, bot_ids: List[str]) -> int:
+        """Link many bots in one statement, skipping unknown and already linked ones"""
+        if not bot_ids:
+            return 0
+        result = await self.session.execute(
+            insert(UserBotAssociation).from_select(
+                ["user_id", "bot_id"],
+                select(literal(user_id), Bot.id)
+                .where(Bot.id.in_(bot_ids))
+                .where(~self._linked_to(user_id))
+            )
+        )
+        await self.session.commit()
+        logger.info(f"Linked {result.rowcount} bots to user {user_id}")
+        return result.rowcount
+
+    async def unlink_bots_from_user(self, user_id: int, bot_ids: List[str]) -> int:
+        """Unlink many bots in one statement, return the number of removed links"""
+        if not bot_ids:
+            return 0
+        result = await self.session.execute(
+            delete(UserBotAssociation)
+            .where(UserBotAssociation.user_id == user_id)
+            .where(UserBotAssociation.bot_id.in_(bot_ids))
+        )
+        await self.session.commit()
+        logger.info(f"Unlinked {result.rowcount} bots from user {user_id}")
+        return result.rowcount
+
+    async def delete_qr(self, bot_id: str, commit: bool = True) -> bool:
+        # Сброс QR сопровождает смену авторизации и пишется сразу
+        bot_state_buffer.discard(bot_id)
         result = await self.session.execute(
             update(Bot)
             .where(Bot.id == bot_id)
             .values(current_qr=None)
         )
-        await self.session.commit()
+        if commit:
+            await self.session.commit()
         logger.info(f"Deleted QR for bot: {bot_id}")
         return result.rowcount > 0
 
@@ -131,28 +235,131 @@ class UserRepository:
         user_data = result.scalar_one_or_none()
         return user_data and user_data.get("is_admin", False)
 
-    async def set_qr_message(self, tg_id: int, bot_id: str, message_id: int) -> bool:
+    async def get_users_with_links(self) -> List[User]:
+        """Get all users together with their linked bots"""
         result = await self.session.execute(
-            select(User).where(User.tg_id == tg_id)
+            select(User).options(selectinload(User.bots))
         )
-        user = result.scalar_one_or_none()
-        if not user:
-            return False
-        user_data = user.data or {}
-        qr_messages = user_data.get("qr_messages", {})
-        qr_messages[bot_id] = message_id
-        user_data["qr_messages"] = qr_messages
-        await self.session.execute(
-            update(User)
-            .where(User.tg_id == tg_id)
-            .values(data=user_data)
-        )
-        await self.session.commit()
-        logger.info(f"Updated data for user: {tg_id}")
-        return True
-    async def get_qr_message(self, tg_id: int, bot_id: str) -> Optional[int]:
+        return list(result.scalars().all())
+
+    async def get_users_data(self, tg_ids: List[int]) -> Dict[int, dict]:
+        """Get data of many users in a single query"""
+        if not tg_ids:
+            return {}
         result = await self.session.execute(
-            select(User.data).where(User.tg_id == tg_id)
+            select(User.tg_id, User.data).where(User.tg_id.in_(tg_ids))
         )
-        user_data = result.scalar_one_or_none()
-        return user_data.get("qr_messages", {}).get(bot_id)
\ No newline at end of file
+        return {tg_id: dict(data or {}) for tg_id, data in result.all()}
+
+    async def get_all_users_data(self) -> Dict[int, dict]:
+        result = await self.session.execute(select(User.tg_id, User.data))
+        return {tg_id: dict(data or {}) for tg_id, data in result.all()}
+
+    async def set_data_path(self, path: List[str], values: Dict[int, Any], commit: bool = True):
+        """Set ``data[path[0]][path[1]]...`` of many users in a single UPDATE, keeping other keys.
+
+        Missing objects along the path are created, so concurrent writers of
+        different keys do not overwrite each other.
+        """
+        if not values:
+            return
+        users = User.__table__
+        dialect = self.session.get_bind().dialect.name
+        value = bindparam("b_value", type_=JSON)
+
+        # Пустые данные бывают как NULL, так и JSON null
+        if dialect == "sqlite":
+            sqlite_path = _sqlite_json_path(*path)
+            data = case((func.json_type(users.c.data) == "object", users.c.data), else_="{}")
+            data = func.json_set(data, sqlite_path, func.json(value))
+        elif dialect == "postgresql":
+            empty = cast("{}", JSONB)
+            data = cast(users.c.data, JSONB)
+            data = case((func.jsonb_typeof(data) == "object", data), else_=empty)
+            # jsonb_set создает только последний ключ пути, промежуточные объекты создаем сами
+            for depth in range(1, len(path)):
+                parent = cast(path[:depth], ARRAY(Text))
+                data = func.jsonb_set(data, parent, func.coalesce(data.op("#>")(parent), empty))
+            data = cast(func.jsonb_set(data, cast(path, ARRAY(Text)), cast(value, JSONB)), JSON)
+        else:
+            # Диалект без JSON-путей: читаем под блокировкой строк и пишем целиком
+            result = await self.session.execute(
+                select(User.tg_id, User.data).where(User.tg_id.in_(list(values))).with_for_update()
+            )
+            changed = {}
+            for tg_id, user_data in result.all():
+                user_data = dict(user_data or {})
+                node = user_data
+                for key in path[:-1]:
+                    node[key] = dict(node.get(key) or {})
+                    node = node[key]
+                node[path[-1]] = values[tg_id]
+                changed[tg_id] = user_data
+            if changed:
+                await self.session.execute(
+                    update(users)
+                    .where(users.c.tg_id == bindparam("b_tg_id"))
+                    .values(data=bindparam("b_data")),
+                    [{"b_tg_id": tg_id, "b_data": user_data} for tg_id, user_data in changed.items()]
+                )
+            if commit:
+                await self.session.commit()
+            return
+
+        await self.session.execute(
+            update(users)
+            .where(users.c.tg_id == bindparam("b_tg_id"))
+            .values(data=data),
+            [{"b_tg_id": tg_id, "b_value": user_value} for tg_id, user_value in values.items()]
+        )
+        if commit:
+            await self.session.commit()
+
+    async def clear_bot_flags(self, key: str, bot_id: str, tg_ids: Optional[List[int]] = None,
+                              commit: bool = True) -> int:
+        """Remove ``data[key][bot_id]`` of all (or the given) users in a single UPDATE"""
+        if tg_ids is not None and not tg_ids:
+            return 0
+        users = User.__table__
+        dialect = self.session.get_bind().dialect.name
+
+        if dialect == "sqlite":
+            path = _sqlite_json_path(key, bot_id)
+            query = (
+                update(users)
+                .where(func.json_extract(users.c.data, path).isnot(None))
+                .values(data=func.json_remove(users.c.data, path))
+            )
+        elif dialect == "postgresql":
+            data = cast(users.c.data, JSONB)
+            query = (
+                update(users)
+                .where(data[key].has_key(bot_id))
+                .values(data=cast(data.op("#-")(cast([key, bot_id], ARRAY(Text))), JSON))
+            )
+        else:
+            # Диалект без JSON-путей: читаем и пишем данные затронутых пользователей
+            users_data = await (self.get_users_data(tg_ids) if tg_ids is not None else self.get_all_users_data())
+            changed = {
+                tg_id: {**data, key: {k: v for k, v in data[key].items() if k != bot_id}}
+                for tg_id, data in users_data.items()
+                if bot_id in (data.get(key) or {})
+            }
+            if changed:
+                await self.session.execute(
+                    update(users)
+                    .where(users.c.tg_id == bindparam("b_tg_id"))
+                    .values(data=bindparam("b_data")),
+                    [{"b_tg_id": tg_id, "b_data": data} for tg_id, data in changed.items()]
+                )
+            if commit:
+                await self.session.commit()
+            return len(changed)
+
+        if tg_ids is not None:
+            query = query.where(users.c.tg_id.in_(tg_ids))
+        result = await self.session.execute(query)
+        if commit:
+            await self.session.commit()
+        logger.info(f"Cleared {key} of bot {bot_id} for {result.rowcount} users")
+        return result.rowcount
@@ -0,0 +1,10 @@
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from core.config import settings
+from core.tracing import instrument_engine
+
+# Single engine shared by the API, the bot and startup scripts
+engine = create_async_engine(settings.DATABASE_URL)
+instrument_engine(engine)
+async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
@@ -0,0 +1,98 @@
+import asyncio
+from typing import Dict, Optional
+
+from sqlalchemy import update, bindparam
+from sqlalchemy.orm.attributes import set_committed_value
+
+from core.config import settings
+from core.logger import logger
+from db.models import Bot
+from db.session import async_session
+
+
+class BotStateBuffer:
+    """Write-behind buffer for the current QR of every bot.
+
+    With ``BOT_STATE_FLUSH_INTERVAL`` above zero, QR rotations only update
+    the buffer; changed rows are written in one batched transaction every
+    interval and on shutdown. Reads through ``BotRepository.get_bot`` see
+    buffered values, in this process only, so the Telegram worker has to
+    run embedded. Auth-state changes keep writing through and drop any
+    buffered QR of the bot; a batch only lands on bots that are still
+    unauthenticated, so a flush racing the change cannot restore a QR.
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, Optional[str]] = {}
+        self._flushing: Dict[str, Optional[str]] = {}  # пакет, который пишется сейчас
+        self._stopped = asyncio.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.BOT_STATE_FLUSH_INTERVAL > 0
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def set_qr(self, bot_id: str, qr_data: Optional[str]):
+        self._pending[bot_id] = qr_data
+
+    def discard(self, bot_id: str):
+        self._pending.pop(bot_id, None)
+        self._flushing.pop(bot_id, None)
+
+    def overlay(self, bot: Optional[Bot]) -> Optional[Bot]:
+        """Show the buffered QR on a loaded bot without marking it dirty"""
+        if bot is not None and bot.id in self._pending:
+            set_committed_value(bot, "current_qr", self._pending[bot.id])
+        return bot
+
+    async def flush(self) -> int:
+        """Write every buffered QR in one transaction, return the number of rows"""
+        if not self._pending:
+            return 0
+        batch = self._flushing = self._pending
+        self._pending = {}
+        try:
+            async with async_session() as db:
+                # Боты, чей QR сбросили после обмена, уже выпали из пакета
+                rows = [{"b_id": bot_id, "b_qr": qr_data} for bot_id, qr_data in batch.items()]
+                if not rows:
+                    return 0
+                # Авторизованному боту QR не нужен: так сброс QR, пришедший во время записи, не затирается
+                await db.execute(
+                    update(Bot.__table__)
+                    .where(Bot.__table__.c.id == bindparam("b_id"))
+                    .where(Bot.__table__.c.authed == False)  # noqa: E712
+                    .values(current_qr=bindparam("b_qr")),
+                    rows
+                )
+                await db.commit()
+        except Exception as e:
+            # Возвращаем в буфер то, что не успело перезаписаться более новым значением или сброситься
+            for bot_id, qr_data in batch.items():
+                self._pending.setdefault(bot_id, qr_data)
+            logger.error(f"Failed to flush {len(batch)} buffered bot states: {e}")
+            return 0
+        finally:
+            self._flushing = {}
+        logger.debug(f"Flushed {len(rows)} buffered bot states")
+        return len(rows)
+
+    async def start(self):
+        """Flush on an interval until stopped"""
+        self._stopped.clear()
+        logger.info(f"Starting bot state write-behind, flushing every {settings.BOT_STATE_FLUSH_INTERVAL}s")
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=settings.BOT_STATE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def stop(self):
+        self._stopped.set()
+
+
+# Create global bot state buffer instance
+bot_state_buffer = BotStateBuffer()
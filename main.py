@@ -1,3 +1,4 @@
+from core.startup import startup_timer
 import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
@@ -7,26 +8,70 @@ import uvicorn
 from core.config import settings
 from core.logger import logger
 from api.endpoints import router as api_router
-from bot.services.bot_connector import bot_connector
+from api.admission import admission
+from api.idempotency import IdempotencyMiddleware
+from bot.services.presence import presence
+from bot.worker import delivery_worker
+from core.events import event_bus, InMemoryEventBus
+from core.redis import close_redis
+from core.shutdown import drain
+from core.tracing import TracingMiddleware, shutdown_tracing
+from db.write_behind import bot_state_buffer
 from scripts.init_db import init_db
 
+startup_timer.mark("imports")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup and shutdown events"""
     try:
         # Initialize database with default admin user
-        await init_db()
+        with startup_timer.step("init_db"):
+            await init_db()
         
-        # Start Telegram bot
-        bot_task = asyncio.create_task(bot_connector.start())
+        # Start batched QR writes
+        flush_task = None
+        if bot_state_buffer.enabled:
+            flush_task = asyncio.create_task(bot_state_buffer.start())
+
+        # Heartbeats land in this process, so silence detection runs here too
+        presence_task = asyncio.create_task(presence.start())
+
+        # Start Telegram polling and delivery, unless a separate worker handles them
+        if settings.EMBEDDED_WORKER:
+            with startup_timer.step("worker"):
+                await delivery_worker.start()
+        elif isinstance(event_bus, InMemoryEventBus):
+            raise RuntimeError("EMBEDDED_WORKER=false requires EVENT_BUS_BACKEND=redis")
+        elif bot_state_buffer.enabled:
+            # Буфер виден только этому процессу, отдельный воркер читал бы устаревший QR
+            raise RuntimeError("EMBEDDED_WORKER=false requires BOT_STATE_FLUSH_INTERVAL=0")
         logger.info("Application started successfully")
+        startup_timer.report()
         
         yield
-        
-        # Stop Telegram bot
-        bot_task.cancel()
-        await bot_connector.stop()
+
+        # Ingestion answers 503 from here on, the steps below share one deadline
+        drain.begin()
+        await drain.wait_until_empty(lambda: admission.in_flight, "ingestion requests")
+
+        # Silence checks would publish new events, the final flush writes last_seen
+        presence.stop()
+        await presence_task
+
+        if settings.EMBEDDED_WORKER:
+            await delivery_worker.stop()
+
+        # Write buffered QRs before exit
+        if flush_task:
+            buffered = bot_state_buffer.pending()
+            bot_state_buffer.stop()
+            await flush_task
+            drain.report.add("bot states", buffered - bot_state_buffer.pending(), bot_state_buffer.pending())
+        drain.finish()
+        await close_redis()
+        shutdown_tracing()
         logger.info("Application stopped successfully")
     except Exception as e:
         logger.error(f"Application error: {e}")
@@ -35,6 +80,9 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(title="GFP Watcher-QR", lifespan=lifespan)
 
+# Replay responses of retried ingestion requests
+app.add_middleware(IdempotencyMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -44,6 +92,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so the request span covers every other middleware
+app.add_middleware(TracingMiddleware)
+
 # Include API routes
 app.include_router(api_router, prefix="/api")
 
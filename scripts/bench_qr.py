@@ -0,0 +1,34 @@
+import sys
+import os
+import time
+
+# Add the project root to sys.path to ensure modules like 'bot' can be found
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from bot.services.qr_renderer import ENCODERS
+
+# Typical WhatsApp Web pairing payload: ref, public keys and client id
+SAMPLE_PAYLOAD = (
+    "2@Xq8bHk3mVZpQ1rT9sW2yU4iO6pA8sD0fG2hJ4kL6zX8cV0bN2mQ4wE6rT8yU0iO2pA4sD6fG8hJ0kL2zX4cV6bN8mQ0wE2rT4y,"
+    "kQ3nR8sT1vW4xY7zA0bC3dE6fG9hJ2kL5mN8pQ1rS4t=,"
+    "uV7wX0yZ3aB6cD9eF2gH5iJ8kL1mN4oP7qR0sT3uV6w=,"
+    "xY9zA2bC5dE8fG1hJ4kL7mN0p=,1"
+)
+
+
+def bench(payload: str, rounds: int = 50):
+    print(f"Payload length: {len(payload)} chars, {rounds} rounds per format\n")
+    print(f"{'format':<8}{'bytes':>10}{'encode ms':>12}")
+    for fmt, encoder in ENCODERS.items():
+        encoder(payload)  # warm-up, loads qrcode/PIL
+        started = time.perf_counter()
+        for _ in range(rounds):
+            image = encoder(payload)
+        elapsed = (time.perf_counter() - started) / rounds
+        print(f"{fmt:<8}{len(image):>10}{elapsed * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    bench(sys.argv[1] if len(sys.argv) > 1 else SAMPLE_PAYLOAD)
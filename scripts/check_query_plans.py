@@ -0,0 +1,96 @@
+"""Check that hot fan-out queries stay index-backed.
+
+Runs the repository methods used on notification and listing paths against
+a scratch SQLite database, runs ``EXPLAIN QUERY PLAN`` on every statement
+they emit and exits non-zero when a plan falls back to a full table scan.
+
+    python -m scripts.check_query_plans
+"""
+import asyncio
+import os
+import re
+import sys
+import tempfile
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from db.models import Base, Bot, User, UserBotAssociation
+from db.repository import BotRepository, UserRepository
+
+USERS = 200
+BOTS = 50
+
+# Full scan of a table, index scans ("SCAN t USING [COVERING] INDEX") are fine
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+# name -> (query, tables it may scan in full)
+HOT_QUERIES = {
+    "get_users_linked_to_bot": (lambda db: UserRepository(db).get_users_linked_to_bot("bot_7"), set()),
+    "get_user_bots": (lambda db: UserRepository(db).get_user_bots(7), set()),
+    "get_unlinked_bots": (lambda db: BotRepository(db).get_unlinked_bots(7, limit=11), set()),
+    "get_unlinked_bots_next_page": (lambda db: BotRepository(db).get_unlinked_bots(7, after="bot_3", limit=11), set()),
+    "link_bots_to_user": (lambda db: BotRepository(db).link_bots_to_user(7, ["bot_1", "bot_2", "bot_8"]), set()),
+    "unlink_bots_from_user": (lambda db: BotRepository(db).unlink_bots_from_user(7, ["bot_1", "bot_2"]), set()),
+    "get_users_data": (lambda db: UserRepository(db).get_users_data([1, 2, 3]), set()),
+    "pending_auth_bots": (lambda db: db.execute(select(Bot.id).where(Bot.authed == False)), set()),  # noqa: E712
+    "get_pending_auth_bots": (lambda db: BotRepository(db).get_pending_auth_bots(7), set()),
+}
+
+
+async def seed(session: AsyncSession):
+    session.add_all(Bot(id=f"bot_{i}", name=f"Bot {i}", authed=i % 10 != 0) for i in range(BOTS))
+    session.add_all(User(tg_id=i, data={}) for i in range(USERS))
+    session.add_all(
+        UserBotAssociation(user_id=user_id, bot_id=f"bot_{(user_id + offset) % BOTS}")
+        for user_id in range(USERS) for offset in range(3)
+    )
+    await session.commit()
+
+
+async def check() -> bool:
+    path = os.path.join(tempfile.mkdtemp(), "plans.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_factory() as session:
+        await seed(session)
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("ANALYZE")
+
+    statements = []
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith(("BEGIN", "COMMIT", "ROLLBACK")):
+            statements.append((statement, parameters))
+
+    ok = True
+    for name, (run, allowed_scans) in HOT_QUERIES.items():
+        statements.clear()
+        async with session_factory() as session:
+            await run(session)
+        recorded = list(statements)
+
+        async with engine.connect() as conn:
+            for statement, parameters in recorded:
+                plan = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+                details = [row[-1] for row in plan]
+                matches = [FULL_SCAN.match(detail) for detail in details]
+                scans = [match.group(1) for match in matches if match and match.group(1) not in allowed_scans]
+                status = "FAIL" if scans else "ok"
+                ok = ok and not scans
+                print(f"[{status}] {name}: {' | '.join(details)}")
+
+    await engine.dispose()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(check()) else 1)
@@ -8,25 +8,70 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select
+from typing import Optional
+
+from sqlalchemy import inspect, select
 
 from db.models import Base, User
-from core.config import settings
+from db.session import engine, async_session
 from core.logger import logger
 
 
+def get_alembic_head() -> Optional[str]:
+    """Return the head revision of the migration scripts, if any"""
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    config = Config(os.path.join(project_root, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(project_root, "db", "migrations"))
+    try:
+        return ScriptDirectory.from_config(config).get_current_head()
+    except Exception as e:
+        logger.debug(f"Could not resolve Alembic head: {e}")
+        return None
+
+
+def get_current_revision(connection) -> Optional[str]:
+    from alembic.runtime.migration import MigrationContext
+
+    return MigrationContext.configure(connection).get_current_revision()
+
+
+def create_missing_columns(connection):
+    """Add nullable columns that were introduced after the table was created"""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+            logger.info(f"Added column {table.name}.{column.name}")
+
+
+def create_missing_indexes(connection):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
 async def init_db():
     """Initialize database with tables and default admin user"""
-    engine = create_async_engine(settings.DATABASE_URL)
-    
-    # Create tables
+    head = get_alembic_head()
+
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        logger.info("Database tables created successfully")
-    
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        current = await conn.run_sync(get_current_revision)
+        if head and current == head:
+            # Схема уже на последней миграции, create_all не нужен
+            logger.info(f"Database schema is at Alembic head {head}, skipping create_all")
+        else:
+            # Create tables
+            await conn.run_sync(Base.metadata.create_all)
+            # create_all не добавляет колонки и индексы к уже существующим таблицам
+            await conn.run_sync(create_missing_columns)
+            await conn.run_sync(create_missing_indexes)
+            logger.info("Database tables created successfully")
     
     async with async_session() as session:
         # Check if admin user exists
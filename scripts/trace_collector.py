@@ -0,0 +1,127 @@
+"""Minimal local OTLP/HTTP trace collector.
+
+Accepts protobuf exports on ``/v1/traces``, keeps the received spans in
+memory and prints one line per span. Point the service at it with
+``TRACING_EXPORTER=otlp`` and ``TRACING_OTLP_ENDPOINT=http://localhost:4318/v1/traces``.
+Needs ``opentelemetry-proto``, installed with the OTLP exporter.
+
+    python -m scripts.trace_collector [port]
+
+Tests can run it in the background instead:
+
+    collector = TraceCollector(port=0).start()
+    ...  # export spans to collector.endpoint
+    collector.stop()
+    names = [span["name"] for span in collector.spans]
+"""
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
+    ExportTraceServiceRequest,
+    ExportTraceServiceResponse,
+)
+
+DEFAULT_PORT = 4318  # standard OTLP/HTTP port
+
+
+def _attribute_value(value):
+    kind = value.WhichOneof("value")
+    return getattr(value, kind) if kind else None
+
+
+def decode_spans(body: bytes) -> List[dict]:
+    """Flatten an OTLP export request into plain span dicts"""
+    request = ExportTraceServiceRequest()
+    request.ParseFromString(body)
+    spans = []
+    for resource_spans in request.resource_spans:
+        resource = {attr.key: _attribute_value(attr.value) for attr in resource_spans.resource.attributes}
+        for scope_spans in resource_spans.scope_spans:
+            for span in scope_spans.spans:
+                spans.append({
+                    "service": resource.get("service.name"),
+                    "name": span.name,
+                    "trace_id": span.trace_id.hex(),
+                    "span_id": span.span_id.hex(),
+                    "parent_id": span.parent_span_id.hex() or None,
+                    "duration_ms": (span.end_time_unix_nano - span.start_time_unix_nano) / 1e6,
+                    "attributes": {attr.key: _attribute_value(attr.value) for attr in span.attributes},
+                })
+    return spans
+
+
+class TraceCollector:
+    """Background OTLP/HTTP receiver that stores every span it gets"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, echo: bool = False):
+        self.spans: List[dict] = []
+        self.echo = echo
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/traces"
+
+    def _handler(self):
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != "/v1/traces":
+                    self.send_error(404)
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    spans = decode_spans(body)
+                except Exception as e:
+                    self.send_error(400, str(e))
+                    return
+                collector.add(spans)
+                payload = ExportTraceServiceResponse().SerializeToString()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-protobuf")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def add(self, spans: List[dict]):
+        with self._lock:
+            self.spans.extend(spans)
+        if self.echo:
+            for span in spans:
+                print(
+                    f"{span['trace_id'][:8]} {span['span_id'][:8]} <- {(span['parent_id'] or '-')[:8]:8} "
+                    f"{span['duration_ms']:9.2f}ms {span['name']} {span['attributes']}"
+                )
+
+    def start(self) -> "TraceCollector":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    collector = TraceCollector(host="0.0.0.0", port=port, echo=True)
+    print(f"Collecting traces on {collector.endpoint}")
+    try:
+        collector._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
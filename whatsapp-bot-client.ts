@@ -10,9 +10,16 @@ const API_CONFIG = {
     STATUS: '/status',
     REGISTER: '/whatsapp/register',
     CHECK_REGISTER: '/whatsapp/check_register',
+    ENSURE_REGISTER: '/whatsapp/ensure_register',
     UPDATE_QR: '/whatsapp/update_qr',
-    UPDATE_AUTH_STATE: '/whatsapp/update_auth_state'
-  }
+    UPDATE_AUTH_STATE: '/whatsapp/update_auth_state',
+    HEARTBEAT: '/whatsapp/heartbeat'
+  },
+  // Must stay below the server's BOT_HEARTBEAT_TIMEOUT
+  HEARTBEAT_INTERVAL_MS: 30000,
+  // Retries of mutating requests reuse one Idempotency-Key, so the server never repeats side effects
+  MAX_ATTEMPTS: 3,
+  RETRY_DELAY_MS: 1000
 } as const;
 
 // Types
@@ -40,6 +47,11 @@ interface WhatsAppBotAuthedStateRequest {
   state: 'authed' | 'not_authed';
 }
 
+interface WhatsAppBotHeartbeatRequest {
+  bot_id: string;
+  state?: 'authed' | 'not_authed';
+}
+
 interface WhatsAppBotResponse {
   success: boolean;
   message: string;
@@ -51,6 +63,8 @@ interface HealthCheckResponse {
   version: string;
 }
 
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
 // Main Client Class
 export class WhatsAppBotClient {
   private baseUrl: string;
@@ -65,32 +79,52 @@ export class WhatsAppBotClient {
   private async makeRequest<T>(
     endpoint: string,
     method: 'GET' | 'POST' = 'GET',
-    body?: any
+    body?: any,
+    idempotent: boolean = method === 'POST'
   ): Promise<T> {
     const url = `${this.baseUrl}${endpoint}`;
-    
+    const headers: Record<string, string> = {
+      'Content-Type': 'application/json',
+    };
+    if (idempotent) {
+      headers['Idempotency-Key'] = crypto.randomUUID();
+    }
+
     const options: RequestInit = {
       method,
-      headers: {
-        'Content-Type': 'application/json',
-      },
+      headers,
     };
 
     if (body) {
       options.body = JSON.stringify(body);
     }
 
-    try {
-      const response = await fetch(url, options);
-      
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
+    for (let attempt = 1; ; attempt++) {
+      try {
+        const response = await fetch(url, options);
+
+        // 409/429/5xx are safe to retry with the same Idempotency-Key
+        const retryable = response.status === 409 || response.status === 429 || response.status >= 500;
+        if (retryable && attempt < API_CONFIG.MAX_ATTEMPTS) {
+          const retryAfter = Number(response.headers.get('Retry-After'));
+          await sleep(retryAfter > 0 ? retryAfter * 1000 : API_CONFIG.RETRY_DELAY_MS * attempt);
+          continue;
+        }
+
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        return await response.json();
+      } catch (error) {
+        // Network errors are retried too, HTTP errors above are already final
+        if (error instanceof TypeError && attempt < API_CONFIG.MAX_ATTEMPTS) {
+          await sleep(API_CONFIG.RETRY_DELAY_MS * attempt);
+          continue;
+        }
+        console.error(`API request failed for ${endpoint}:`, error);
+        throw error;
       }
-      
-      return await response.json();
-    } catch (error) {
-      console.error(`API request failed for ${endpoint}:`, error);
-      throw error;
     }
   }
 
@@ -125,6 +159,18 @@ export class WhatsAppBotClient {
     );
   }
 
+  /**
+   * Register the bot or refresh its details in one request
+   */
+  async ensureRegistered(botData: WhatsAppBotData): Promise<WhatsAppBotResponse> {
+    const request: WhatsAppBotRegisterRequest = { bot: botData };
+    return this.makeRequest<WhatsAppBotResponse>(
+      API_CONFIG.ENDPOINTS.ENSURE_REGISTER,
+      'POST',
+      request
+    );
+  }
+
   /**
    * Update QR code for bot
    */
@@ -158,31 +204,59 @@ export class WhatsAppBotClient {
     );
   }
 
+  /**
+   * Report that the bot process is alive
+   */
+  async sendHeartbeat(
+    botId: string,
+    state?: 'authed' | 'not_authed'
+  ): Promise<WhatsAppBotResponse> {
+    const request: WhatsAppBotHeartbeatRequest = {
+      bot_id: botId,
+      state: state
+    };
+    // Heartbeats repeat anyway, storing them for replay would only waste server memory
+    return this.makeRequest<WhatsAppBotResponse>(
+      API_CONFIG.ENDPOINTS.HEARTBEAT,
+      'POST',
+      request,
+      false
+    );
+  }
+
+  /**
+   * Send heartbeats in the background, returns a function that stops them
+   */
+  startHeartbeat(
+    botId: string,
+    getState?: () => 'authed' | 'not_authed',
+    intervalMs: number = API_CONFIG.HEARTBEAT_INTERVAL_MS
+  ): () => void {
+    const beat = () => {
+      this.sendHeartbeat(botId, getState?.()).catch(error => {
+        console.error('❌ Heartbeat failed:', error);
+      });
+    };
+    beat();
+    const timer = setInterval(beat, intervalMs);
+    return () => clearInterval(timer);
+  }
+
   /**
    * Complete bot initialization flow
    */
   async initializeBot(botData: WhatsAppBotData): Promise<boolean> {
     try {
-      console.log('🔍 Checking bot registration...');
-      
-      // Check if bot is already registered
-      const checkResponse = await this.checkRegistration(botData.id);
-      
-      if (checkResponse.success) {
-        console.log('✅ Bot is already registered');
-        return true;
-      }
+      console.log('📝 Registering bot...');
 
-      console.log('📝 Registering new bot...');
-      
-      // Register the bot
-      const registerResponse = await this.registerBot(botData);
-      
-      if (registerResponse.success) {
-        console.log('✅ Bot registered successfully');
+      // Register the bot, or confirm it is already registered
+      const response = await this.ensureRegistered(botData);
+
+      if (response.success) {
+        console.log(response.data?.created ? '✅ Bot registered successfully' : '✅ Bot is already registered');
         return true;
       } else {
-        console.error('❌ Failed to register bot:', registerResponse.message);
+        console.error('❌ Failed to register bot:', response.message);
         return false;
       }
     } catch (error) {
@@ -262,4 +336,7 @@ await client.sendQRCode(botData.id, 'base64_qr_data_here');
 
 // Set authenticated
 await client.setAuthenticated(botData.id, true);
+
+// Keep reporting liveness while the process runs
+const stopHeartbeat = client.startHeartbeat(botData.id);
 */ 
\ No newline at end of file